@@ -0,0 +1,148 @@
+"""
+Compares the WSGI (gunicorn sync workers, src/wsgi.py) and ASGI (uvicorn, src/asgi.py)
+serving modes on the same seeded database at increasing numbers of concurrent connections.
+
+    python benchmarks/async_vs_sync.py --workers 2 --concurrency 10,100,500 --duration 10
+
+Both servers run as subprocesses; the load comes from asyncio keep-alive HTTP/1.1 clients,
+so thousands of connections can be opened from a single process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import time
+from seed import ROOT, seed
+
+PATHS = ['/people', '/planets/{id}', '/starships', '/people/{id}', '/users/{id}/favorites']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'wsgi':
+        return ['gunicorn', 'wsgi', '--chdir', os.path.join(ROOT, 'src'),
+                '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    return ['uvicorn', 'asgi:app', '--app-dir', os.path.join(ROOT, 'src'),
+            '--workers', str(workers), '--port', str(port), '--log-level', 'warning']
+
+
+def wait_until_listening(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+async def client(port, paths, deadline, latencies, errors):
+    reader = writer = None
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            start = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError
+            length, chunked, close = 0, False, False
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                name, value = name.lower(), value.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'transfer-encoding' and 'chunked' in value:
+                    chunked = True
+                elif name == 'connection' and value == 'close':
+                    close = True
+            if chunked:
+                while (size := int((await reader.readline()).strip() or b'0', 16)):
+                    await reader.readexactly(size + 2)
+                await reader.readline()
+            else:
+                await reader.readexactly(length)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if int(status_line.split()[1]) >= 500:
+                errors.append(path)
+            if close:
+                # Sync gunicorn workers do not keep connections alive
+                writer.close()
+                reader = writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            errors.append(path)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, concurrency, duration):
+    paths = [path.replace('{id}', str(1 + n % 50)) for n in range(50) for path in PATHS]
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(port, paths[n:] + paths[:n], deadline, latencies, errors)
+                           for n in range(concurrency)))
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 3) if latencies else None
+    return {'concurrency': concurrency, 'requests': len(latencies), 'errors': len(errors),
+            'throughput_rps': round(len(latencies) / duration, 2),
+            'p50_ms': pct(50), 'p95_ms': pct(95), 'p99_ms': pct(99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:////tmp/benchmark.db')
+    parser.add_argument('--people', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', default='10,100,500')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    seed(args.url, people=args.people, users=args.users)
+    env = dict(os.environ, DATABASE_URL=args.url, METRICS_SAMPLE_RATE='0', RATELIMIT_ENABLED='0')
+    report = {'workers': args.workers, 'duration_s': args.duration, 'modes': {}}
+    for mode in args.modes.split(','):
+        port = free_port()
+        command = server_command(mode, port, args.workers)
+        if shutil.which(command[0]) is None:
+            report['modes'][mode] = {'skipped': f'{command[0]} is not installed'}
+            continue
+        server = subprocess.Popen(command, env=env)
+        try:
+            wait_until_listening(port)
+            report['modes'][mode] = [asyncio.run(load(port, int(level), args.duration))
+                                     for level in args.concurrency.split(',')]
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
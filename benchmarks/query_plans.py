@@ -0,0 +1,89 @@
+"""
+Query plans and latency of the favorites and catalog lookups with and without their indexes.
+
+    python benchmarks/query_plans.py --people 200000 --users 5000 --output plans.json
+"""
+import argparse
+import json
+import statistics
+import time
+from sqlalchemy import text
+from seed import seed
+
+# Indexes added by migrations c41f8a2d6e13 and d93a7c5b2f48
+INDEXES = [
+    ('uq_favorite_people_user_id_people_id', 'favorite_people', 'user_id, people_id', True),
+    ('uq_favorite_planets_user_id_planet_id', 'favorite_planets', 'user_id, planet_id', True),
+    ('uq_favorite_starships_user_id_starship_id', 'favorite_starships', 'user_id, starship_id', True),
+    ('ix_favorite_people_people_id', 'favorite_people', 'people_id', False),
+    ('ix_favorite_planets_planet_id', 'favorite_planets', 'planet_id', False),
+    ('ix_favorite_starships_starship_id', 'favorite_starships', 'starship_id', False),
+    ('ix_people_name', 'people', 'name', False),
+    ('ix_planet_name', 'planet', 'name', False),
+    ('ix_starship_name', 'starship', 'name', False),
+]
+
+QUERIES = {
+    'delete_favorite_lookup': ('SELECT id FROM favorite_people WHERE user_id = :user_id AND people_id = :entity_id',
+                               {'user_id': 17, 'entity_id': 42}),
+    'user_favorites_load': ('SELECT * FROM favorite_planets WHERE user_id IN (:user_id)', {'user_id': 17}),
+    'who_favorited': ('SELECT user_id FROM favorite_starships WHERE starship_id = :entity_id', {'entity_id': 42}),
+    'name_lookup': ('SELECT id FROM people WHERE name = :name', {'name': 'Luke 4242'}),
+}
+
+
+def explain(connection, sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' '.join(str(col) for col in row) for row in connection.execute(text(prefix + sql), params)]
+
+
+def measure(connection, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': round(statistics.median(timings), 4), 'max_ms': round(max(timings), 4)}
+
+
+def run(connection, repeat):
+    return {name: {'plan': explain(connection, sql, params), **measure(connection, sql, params, repeat)}
+            for name, (sql, params) in QUERIES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:////tmp/benchmark.db')
+    parser.add_argument('--people', type=int, default=100000)
+    parser.add_argument('--planets', type=int, default=20000)
+    parser.add_argument('--starships', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    engine = seed(args.url, people=args.people, planets=args.planets, starships=args.starships,
+                  users=args.users, favorites_per_user=args.favorites_per_user)
+    with engine.begin() as connection:
+        for name, _, _, _ in INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        before = run(connection, args.repeat)
+        for name, table, columns, unique in INDEXES:
+            connection.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX {name} ON {table} ({columns})'))
+        connection.execute(text('ANALYZE'))
+        after = run(connection, args.repeat)
+
+    report = {'url': engine.url.render_as_string(hide_password=True),
+              'rows': {'people': args.people, 'planets': args.planets, 'starships': args.starships,
+                       'users': args.users, 'favorites_per_user': args.favorites_per_user},
+              'before': before, 'after': after}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
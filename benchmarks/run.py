@@ -0,0 +1,220 @@
+"""
+Load test of every API route against a seeded database.
+
+Drives the routes through the Flask test client (in-process) or a real threaded WSGI
+server at a configurable concurrency and prints a JSON report with throughput,
+p50/p95/p99 latency per route and peak RSS. With --baseline the report is compared
+to a previous one and the run fails when a route's p95 regressed beyond --tolerance.
+
+    python benchmarks/run.py --server wsgi --concurrency 16 --requests 200 --output report.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from seed import seed
+
+_emails = itertools.count()
+
+# (name, method, path, json body or a function building it); ids stay within the smallest seeded volumes.
+# DELETE /users/<id> is left out on purpose: it would destroy the seeded data being measured.
+ROUTES = [
+    ('create_user', 'POST', '/users', lambda: {'email': f'bench{next(_emails)}@example.com', 'password': 'secret',
+                                               'username': 'bench', 'name': 'Bench'}),
+    ('sitemap', 'GET', '/', None),
+    ('list_people', 'GET', '/people', None),
+    ('list_people_filtered', 'GET', '/people?gender=female&sort=-height&fields=name,height', None),
+    ('get_person', 'GET', '/people/{id}', None),
+    ('top_people', 'GET', '/people/top', None),
+    ('list_planets', 'GET', '/planets', None),
+    ('get_planet', 'GET', '/planets/{id}', None),
+    ('top_planets', 'GET', '/planets/top', None),
+    ('list_starships', 'GET', '/starships', None),
+    ('get_starship', 'GET', '/starships/{id}', None),
+    ('top_starships', 'GET', '/starships/top', None),
+    ('list_users', 'GET', '/users', None),
+    ('user_favorites', 'GET', '/users/{id}/favorites', None),
+    ('search', 'GET', '/search?q=luke', None),
+    ('multi_get_people', 'GET', '/people?ids=1,2,3,4,5,6,7,8,9,10', None),
+    ('batch', 'POST', '/batch', [['people', 1], ['planets', 2], ['starships', 3], ['people', 4], ['planets', 999999]]),
+    ('changes', 'GET', '/changes?after=0&types=people', None),
+    ('cache_stats', 'GET', '/cache/stats', None),
+    ('healthz', 'GET', '/healthz', None),
+    ('metrics', 'GET', '/metrics', None),
+    ('add_people', 'POST', '/people', {'name': 'Bench', 'gender': 'DROID', 'height': 100}),
+    ('add_people_bulk', 'POST', '/people/bulk', [{'name': 'Bench', 'gender': 'droid', 'height': 100}] * 10),
+    ('add_planet', 'POST', '/planets', {'name': 'Bench', 'size': 1, 'population': 1, 'climate': 'arid'}),
+    ('add_planet_bulk', 'POST', '/planets/bulk', [{'name': 'Bench', 'size': 1, 'population': 1, 'climate': 'arid'}] * 10),
+    ('add_starship', 'POST', '/starships', {'name': 'Bench', 'cost_in_credits': 1, 'speed': 1}),
+    ('add_starship_bulk', 'POST', '/starships/bulk', [{'name': 'Bench', 'cost_in_credits': 1, 'speed': 1}] * 10),
+    ('favorite_person', 'POST', '/favorite/people/{id}', None),
+    ('favorite_planet', 'POST', '/favorite/planet/{id}', None),
+    ('favorite_starship', 'POST', '/favorite/starship/{id}', None),
+    ('unfavorite_person', 'DELETE', '/favorite/people/{id}', None),
+    ('unfavorite_planet', 'DELETE', '/favorite/planet/{id}', None),
+    ('unfavorite_starship', 'DELETE', '/favorite/ship/{id}', None),
+    ('bulk_favorites', 'POST', '/users/{id}/favorites/bulk', {'add': {'people': [1, 2, 3]}, 'remove': {'planets': [1]}}),
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        return client.open(path, method=method, json=body).status_code
+
+    def close(self):
+        pass
+
+
+class WSGIDriver:
+    """A threaded werkzeug server on a free port, hit over keep-alive HTTP connections."""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_route(driver, method, path, body, requests, concurrency):
+    def one(_):
+        payload = body() if callable(body) else body
+        start = time.perf_counter()
+        status = driver.request(method, path, payload)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, status in results if status >= 500)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / wall, 2),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+    }
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, result in report['routes'].items():
+        previous = baseline.get('routes', {}).get(name)
+        if previous and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append({'route': name, 'baseline_p95_ms': previous['p95_ms'], 'p95_ms': result['p95_ms']})
+    return regressions
+
+
+def uncovered_routes(app):
+    """API rules (method and path) that no entry of ROUTES reaches."""
+    adapter = app.url_map.bind('localhost')
+    covered = {adapter.match(path.split('?')[0].replace('{id}', '1'), method=method)[0]
+               for _, method, path, _ in ROUTES}
+    return sorted(f"{','.join(sorted(rule.methods - {'HEAD', 'OPTIONS'}))} {rule.rule}"
+                  for rule in app.url_map.iter_rules()
+                  if rule.endpoint not in covered and rule.endpoint != 'static'
+                  and not rule.rule.startswith('/admin'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:////tmp/benchmark.db')
+    parser.add_argument('--people', type=int, default=10000)
+    parser.add_argument('--planets', type=int, default=2000)
+    parser.add_argument('--starships', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    parser.add_argument('--server', choices=('testclient', 'wsgi'), default='testclient')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--routes', help='comma separated route names to run (default: all)')
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    seed(args.url, people=args.people, planets=args.planets, starships=args.starships,
+         users=args.users, favorites_per_user=args.favorites_per_user)
+    os.environ['DATABASE_URL'] = args.url
+    # Every request comes from one client; the rate limits would measure 429s instead of routes
+    os.environ.setdefault('RATELIMIT_ENABLED', '0')
+    from app import create_app
+    app = create_app()
+
+    driver = WSGIDriver(app) if args.server == 'wsgi' else TestClientDriver(app)
+    selected = set(args.routes.split(',')) if args.routes else None
+    results = {}
+    try:
+        for name, method, path, body in ROUTES:
+            if selected is not None and name not in selected:
+                continue
+            path = path.replace('{id}', '1')
+            results[name] = run_route(driver, method, path, body, args.requests, args.concurrency)
+    finally:
+        driver.close()
+
+    report = {
+        'server': args.server,
+        'concurrency': args.concurrency,
+        'rows': {'people': args.people, 'planets': args.planets, 'starships': args.starships,
+                 'users': args.users, 'favorites_per_user': args.favorites_per_user},
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'uncovered_routes': uncovered_routes(app),
+        'routes': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
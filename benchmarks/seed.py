@@ -0,0 +1,70 @@
+"""
+Seeds a database with synthetic People, Planet, Starship, User and favorites rows for the benchmarks
+"""
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from sqlalchemy import create_engine, insert, select, update, func  # noqa: E402
+from models import db, User, People, Planet, Starship, GenderEnum, TableVersion, \
+    FavoritePeople, FavoritePlanets, FavoriteStarships  # noqa: E402
+
+CHUNK_SIZE = 5000
+CLIMATES = ['arid', 'temperate', 'frozen', 'tropical', 'murky', 'windy']
+NAMES = ['Luke', 'Leia', 'Han', 'Anakin', 'Padme', 'Obi-Wan', 'Yoda', 'Rey', 'Finn', 'Poe',
+         'Tatooine', 'Hoth', 'Naboo', 'Endor', 'Dagobah', 'Falcon', 'X-wing', 'Destroyer']
+
+
+def _insert(connection, model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def _name(rng, i, length):
+    return f'{rng.choice(NAMES)} {i}'[:length]
+
+
+def seed(url, people=10000, planets=2000, starships=2000, users=1000, favorites_per_user=20, seed_value=42):
+    """Creates the schema at `url` and fills it with deterministic synthetic rows."""
+    rng = random.Random(seed_value)
+    engine = create_engine(url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    genders = list(GenderEnum)
+    with engine.begin() as connection:
+        _insert(connection, People, [
+            {'name': _name(rng, i, 30), 'gender': rng.choice(genders), 'height': rng.randint(60, 250)}
+            for i in range(people)])
+        _insert(connection, Planet, [
+            {'name': _name(rng, i, 50), 'size': rng.randint(1000, 200000),
+             'population': rng.randint(0, 2_000_000_000), 'climate': rng.choice(CLIMATES)}
+            for i in range(planets)])
+        _insert(connection, Starship, [
+            {'name': _name(rng, i, 50), 'cost_in_credits': rng.randint(1000, 10_000_000),
+             'speed': rng.randint(100, 3000)}
+            for i in range(starships)])
+        _insert(connection, User, [
+            {'email': f'user{i}@example.com', 'password': 'secret', 'username': f'user{i}', 'name': f'User {i}'}
+            for i in range(users)])
+
+        for model, column, entity_model, total in ((FavoritePeople, 'people_id', People, people),
+                                                   (FavoritePlanets, 'planet_id', Planet, planets),
+                                                   (FavoriteStarships, 'starship_id', Starship, starships)):
+            per_user = min(favorites_per_user, total)
+            _insert(connection, model, [
+                {'user_id': user_id, column: entity_id}
+                for user_id in range(1, users + 1)
+                for entity_id in rng.sample(range(1, total + 1), per_user)])
+            entity_column = getattr(model, column)
+            connection.execute(update(entity_model).values(favorite_count=(
+                select(func.count()).where(entity_column == entity_model.id).scalar_subquery())))
+
+        now = datetime.now(timezone.utc)
+        _insert(connection, TableVersion, [
+            {'table_name': model.__tablename__, 'version': 1, 'updated_at': now}
+            for model in (People, Planet, Starship)])
+    return engine
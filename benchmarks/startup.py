@@ -0,0 +1,110 @@
+"""
+Boot latency of the API: time to import src/app.py, to build the app with create_app() and
+to answer the first request, each measured in a fresh interpreter as a cold worker sees it.
+
+    python benchmarks/startup.py --repeat 10 --output startup.json
+    python benchmarks/startup.py --baseline startup.json --tolerance 0.2
+
+Also lists the slowest imports (python -X importtime) so regressions can be traced to a module.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from seed import ROOT, seed
+
+# Runs in the child interpreter; prints one JSON line of timings in milliseconds
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({config})
+created = time.perf_counter()
+status = application.test_client().get({path!r}).status_code
+answered = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (answered - created) * 1000,
+    "total_ms": (answered - start) * 1000,
+    "status": status,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "admin_loaded": "flask_admin" in sys.modules,
+    "migrate_loaded": "flask_migrate" in sys.modules,
+}}))
+'''
+METRICS = ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms', 'rss_kb')
+
+
+def probe(env, config, path):
+    code = PROBE.format(config=config, path=path)
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(ROOT, 'src'), env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, count):
+    """The `count` modules with the largest cumulative import time, in milliseconds."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=os.path.join(ROOT, 'src'),
+                            env=env, capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append((int(parts[1]) / 1000, parts[2].strip()))
+    return [{'module': module, 'cumulative_ms': round(ms, 3)} for ms, module in sorted(imports, reverse=True)[:count]]
+
+
+def summarize(runs):
+    return {metric: {'median': round(statistics.median(run[metric] for run in runs), 3),
+                     'max': round(max(run[metric] for run in runs), 3)} for metric in METRICS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:////tmp/benchmark.db')
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--path', default='/people', help='route of the first request')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed median regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    seed(args.url, people=args.people, planets=100, starships=100, users=10, favorites_per_user=5)
+    env = dict(os.environ, DATABASE_URL=args.url)
+    variants = {'api': "{'MIGRATE': False}", 'flask_cli': "{'MIGRATE': True}"}
+    report = {'repeat': args.repeat, 'path': args.path, 'variants': {}}
+    for name, config in variants.items():
+        runs = [probe(env, config, args.path) for _ in range(args.repeat)]
+        report['variants'][name] = {**summarize(runs), 'status': runs[-1]['status'],
+                                    'admin_loaded': runs[-1]['admin_loaded'],
+                                    'migrate_loaded': runs[-1]['migrate_loaded']}
+    report['slowest_imports'] = slowest_imports(env, args.top)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = [
+            {'variant': name, 'metric': metric, 'baseline_ms': previous[metric]['median'],
+             'median_ms': result[metric]['median']}
+            for name, result in report['variants'].items()
+            if (previous := baseline.get('variants', {}).get(name))
+            for metric in ('import_ms', 'first_request_ms', 'total_ms')
+            if result[metric]['median'] > previous[metric]['median'] * (1 + args.tolerance)]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""favorite_count on the catalog tables, backfilled from the favorites tables
+
+Revision ID: a8e3d5f71c29
+Revises: f2c8b6a4d071
+Create Date: 2026-10-18 13:52:08.316442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e3d5f71c29'
+down_revision = 'f2c8b6a4d071'
+branch_labels = None
+depends_on = None
+
+# catalog table -> (favorites table, column holding the favorited entity id)
+COUNTED_TABLES = (
+    ('people', 'favorite_people', 'people_id'),
+    ('planet', 'favorite_planets', 'planet_id'),
+    ('starship', 'favorite_starships', 'starship_id'),
+)
+
+
+def upgrade():
+    for table_name, favorites_table, entity_column in COUNTED_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+        # Every row changes its JSON, so its version moves too and cached ETags stop matching
+        op.execute(
+            f'UPDATE {table_name} SET version = version + 1, favorite_count = ('
+            f'SELECT COUNT(*) FROM {favorites_table} WHERE {favorites_table}.{entity_column} = {table_name}.id)')
+        op.create_index(f'ix_{table_name}_favorite_count_id', table_name,
+                        [sa.text('favorite_count DESC'), 'id'], unique=False)
+    op.execute("UPDATE table_version SET version = version + 1 WHERE table_name IN ('people', 'planet', 'starship')")
+
+
+def downgrade():
+    for table_name, _, _ in reversed(COUNTED_TABLES):
+        op.drop_index(f'ix_{table_name}_favorite_count_id', table_name=table_name)
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('favorite_count')
@@ -0,0 +1,44 @@
+"""catalog row versions and table version counters
+
+Revision ID: b7d2e4f1c9a0
+Revises: 37ab97184b53
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f1c9a0'
+down_revision = '37ab97184b53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    for table_name in ('people', 'planet', 'starship'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    now = datetime.now(timezone.utc)
+    op.bulk_insert(table_version, [
+        {'table_name': 'people', 'version': 1, 'updated_at': now},
+        {'table_name': 'planet', 'version': 1, 'updated_at': now},
+        {'table_name': 'starship', 'version': 1, 'updated_at': now}
+    ])
+
+
+def downgrade():
+    for table_name in ('starship', 'planet', 'people'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('version')
+
+    op.drop_table('table_version')
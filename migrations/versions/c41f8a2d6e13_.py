@@ -0,0 +1,38 @@
+"""unique (user_id, entity_id) indexes on the favorites tables
+
+Revision ID: c41f8a2d6e13
+Revises: b7d2e4f1c9a0
+Create Date: 2026-10-18 10:02:55.740126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f8a2d6e13'
+down_revision = 'b7d2e4f1c9a0'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TABLES = (
+    ('favorite_people', 'people_id'),
+    ('favorite_planets', 'planet_id'),
+    ('favorite_starships', 'starship_id'),
+)
+
+
+def upgrade():
+    for table_name, entity_column in FAVORITE_TABLES:
+        # Keep only the oldest row of every duplicated favorite before enforcing uniqueness
+        op.execute(
+            f'DELETE FROM {table_name} WHERE id NOT IN ('
+            f'SELECT id FROM (SELECT MIN(id) AS id FROM {table_name} '
+            f'GROUP BY user_id, {entity_column}) AS keep)')
+        op.create_index(f'uq_{table_name}_user_id_{entity_column}', table_name,
+                        ['user_id', entity_column], unique=True)
+
+
+def downgrade():
+    for table_name, entity_column in FAVORITE_TABLES:
+        op.drop_index(f'uq_{table_name}_user_id_{entity_column}', table_name=table_name)
@@ -0,0 +1,30 @@
+"""user_favorites_document: materialized favorites per user, built on first read
+
+Revision ID: c6e2a9d4b817
+Revises: a8e3d5f71c29
+Create Date: 2026-10-18 16:41:09.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2a9d4b817'
+down_revision = 'a8e3d5f71c29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_favorites_document',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('document', sa.Text(), nullable=True),
+    sa.Column('generation', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_favorites_document')
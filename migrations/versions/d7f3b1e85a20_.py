@@ -0,0 +1,33 @@
+"""change_log: append-only log of the API writes for the /changes feed
+
+Revision ID: d7f3b1e85a20
+Revises: c6e2a9d4b817
+Create Date: 2026-10-18 18:05:52.771390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3b1e85a20'
+down_revision = 'c6e2a9d4b817'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('type', sa.String(length=20), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_change_log_created_at', 'change_log', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_change_log_created_at', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,37 @@
+"""reverse favorites indexes and catalog name indexes
+
+Revision ID: d93a7c5b2f48
+Revises: c41f8a2d6e13
+Create Date: 2026-10-18 10:47:18.902311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a7c5b2f48'
+down_revision = 'c41f8a2d6e13'
+branch_labels = None
+depends_on = None
+
+# (user_id, entity_id) is already covered by the unique indexes of c41f8a2d6e13,
+# which also serve every lookup by user_id alone
+INDEXES = (
+    ('ix_favorite_people_people_id', 'favorite_people', 'people_id'),
+    ('ix_favorite_planets_planet_id', 'favorite_planets', 'planet_id'),
+    ('ix_favorite_starships_starship_id', 'favorite_starships', 'starship_id'),
+    ('ix_people_name', 'people', 'name'),
+    ('ix_planet_name', 'planet', 'name'),
+    ('ix_starship_name', 'starship', 'name'),
+)
+
+
+def upgrade():
+    for index_name, table_name, column in INDEXES:
+        op.create_index(index_name, table_name, [column], unique=False)
+
+
+def downgrade():
+    for index_name, table_name, column in reversed(INDEXES):
+        op.drop_index(index_name, table_name=table_name)
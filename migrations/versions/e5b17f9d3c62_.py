@@ -0,0 +1,36 @@
+"""trigram and full-text search indexes on catalog names (postgresql only)
+
+Revision ID: e5b17f9d3c62
+Revises: d93a7c5b2f48
+Create Date: 2026-10-18 11:30:04.117652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b17f9d3c62'
+down_revision = 'd93a7c5b2f48'
+branch_labels = None
+depends_on = None
+
+CATALOG_TABLES = ('people', 'planet', 'starship')
+
+
+def upgrade():
+    # Other databases are searched with the in-process index of src/search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table_name in CATALOG_TABLES:
+        op.execute(f'CREATE INDEX ix_{table_name}_name_trgm ON {table_name} USING gin (name gin_trgm_ops)')
+        op.execute(f"CREATE INDEX ix_{table_name}_name_tsv ON {table_name} USING gin (to_tsvector('simple', name))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table_name in CATALOG_TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table_name}_name_tsv')
+        op.execute(f'DROP INDEX IF EXISTS ix_{table_name}_name_trgm')
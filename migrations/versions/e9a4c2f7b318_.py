@@ -0,0 +1,26 @@
+"""table_version.snapshot_id: content id of the catalog snapshot the table holds
+
+Revision ID: e9a4c2f7b318
+Revises: d7f3b1e85a20
+Create Date: 2026-10-18 21:12:40.318562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a4c2f7b318'
+down_revision = 'd7f3b1e85a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('table_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('snapshot_id', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('table_version', schema=None) as batch_op:
+        batch_op.drop_column('snapshot_id')
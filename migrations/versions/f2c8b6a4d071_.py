@@ -0,0 +1,36 @@
+"""(column, id) indexes for catalog filtering and sorting
+
+Revision ID: f2c8b6a4d071
+Revises: e5b17f9d3c62
+Create Date: 2026-10-18 12:14:37.552908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8b6a4d071'
+down_revision = 'e5b17f9d3c62'
+branch_labels = None
+depends_on = None
+
+INDEXED_COLUMNS = (
+    ('people', 'gender'),
+    ('people', 'height'),
+    ('planet', 'climate'),
+    ('planet', 'population'),
+    ('planet', 'size'),
+    ('starship', 'cost_in_credits'),
+    ('starship', 'speed'),
+)
+
+
+def upgrade():
+    for table_name, column in INDEXED_COLUMNS:
+        op.create_index(f'ix_{table_name}_{column}_id', table_name, [column, 'id'], unique=False)
+
+
+def downgrade():
+    for table_name, column in reversed(INDEXED_COLUMNS):
+        op.drop_index(f'ix_{table_name}_{column}_id', table_name=table_name)
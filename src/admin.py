@@ -1,17 +1,50 @@
 import os
-from flask_admin import Admin
+from threading import Lock
+from flask import Flask
 from models import db, User, People, Starship, Planet, FavoritePeople, FavoriteStarships, FavoritePlanets
-from flask_admin.contrib.sqla import ModelView
 
 def setup_admin(app):
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     admin.add_view(ModelView(User, db.session))
     admin.add_view(ModelView(People, db.session))
     admin.add_view(ModelView(Planet, db.session))
     admin.add_view(ModelView(FavoritePeople, db.session))
     admin.add_view(ModelView(FavoriteStarships, db.session))
     admin.add_view(ModelView(FavoritePlanets, db.session))
+
+
+class LazyAdmin:
+    """
+    WSGI middleware sending /admin requests to a separate Flask app running the admin UI.
+    That app, and flask_admin with it, is only built on the first /admin request, so workers
+    serving the JSON API never pay for it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._admin_app = None
+        self._lock = Lock()
+
+    def admin_app(self):
+        with self._lock:
+            if self._admin_app is None:
+                admin_app = Flask(__name__)
+                admin_app.config.update(self.app.config)
+                db.init_app(admin_app)
+                setup_admin(admin_app)
+                self._admin_app = admin_app
+        return self._admin_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == '/admin' or path.startswith('/admin/'):
+            return self.admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
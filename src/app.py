@@ -2,50 +2,125 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import click
+from flask import Flask, Blueprint, request, jsonify, current_app
+from flask.cli import FlaskGroup
 from flask_cors import CORS
 from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, People, Planet, Starship, FavoritePeople, FavoritePlanets, FavoriteStarships
+from models import db, User, People, Planet, Starship
+from pagination import list_response
+from filters import parse_query
+from serializers import parse_fields, user_serializer, user_load_options, user_prepare
+from cache import catalog_cache, get_entity, setup_cache
+from conditional import conditional
+from bulk import bulk_import
+from changes import publish, changes_page, setup_changes
+from snapshot import setup_snapshot
+from favorite_documents import favorites_response, setup_favorite_documents
+from favorites import add_favorites, remove_favorites, commit_favorites, bulk_favorites
+from leaderboard import top_favorited
+from search import search_catalog
+from batch import multi_get, batch_get
+from metrics import setup_metrics
+from compression import setup_compression
+from ratelimit import setup_rate_limits
+from querylog import setup_query_log
+from database import engine_options, setup_healthz
+from replicas import replica_binds, setup_replicas
 # from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
-        "postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+api = Blueprint('api', __name__)
+
+
+def _running_flask_cli():
+    """True while the app is loaded by the `flask` command (e.g. `flask db upgrade`)."""
+    context = click.get_current_context(silent=True)
+    return context is not None and isinstance(context.find_root().command, FlaskGroup)
+
+
+def create_app(config=None):
+    """
+    Builds the API app. `config` overrides the settings taken from the environment; besides
+    Flask's own keys it accepts:
+
+        ADMIN    mount the Flask-Admin UI at /admin, built on its first request
+                 (default: ENABLE_ADMIN, on unless set to 0)
+        MIGRATE  register Flask-Migrate and its `flask db` commands
+                 (default: only when the app is loaded by the `flask` command)
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
+            "postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['ADMIN'] = os.environ.get('ENABLE_ADMIN', '1') != '0'
+    app.config['MIGRATE'] = _running_flask_cli()
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    app.config.setdefault('SQLALCHEMY_BINDS', replica_binds(engine_options))
+
+    if app.config['MIGRATE']:
+        # alembic is the slowest import of the app and only the `flask db` commands need it
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    db.init_app(app)
+    CORS(app)
+    if app.config['ADMIN']:
+        from admin import LazyAdmin
+        app.wsgi_app = LazyAdmin(app)
+    app.register_blueprint(api)
+    setup_cache(app)
+    setup_metrics(app)
+    # After setup_metrics: after_request hooks run in reverse, so sizes are measured compressed
+    setup_compression(app)
+    setup_rate_limits(app)
+    setup_query_log(app)
+    setup_healthz(app)
+    setup_replicas(app)
+    setup_favorite_documents(app)
+    setup_changes(app)
+    setup_snapshot(app)
+    return app
 
 # Handle/serialize errors like a JSON object
 
 
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
 
 
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
+
+
+@api.route('/search', methods=['GET'])
+def search():
+    return search_catalog()
+
+
+@api.route('/batch', methods=['POST'])
+def get_batch():
+    return batch_get()
+
+
+@api.route('/changes', methods=['GET'])
+def get_changes():
+    return changes_page()
 
 
 # USER
 
 
-@app.route('/users', methods=['POST'])
+@api.route('/users', methods=['POST'])
 def create_user():
     body = request.get_json(silent=True)
     if body is None:
@@ -71,30 +146,24 @@ def create_user():
     return jsonify({"msg": "Usuario creado exitosamente"}), 201
 
 
-@app.route('/users', methods=['GET'])
+@api.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    users_serialized = []
-    for user in users:
-        users_serialized.append(user.serialize())
-    return jsonify({'data': users_serialized}), 200
+    fields = parse_fields(User)
+    return list_response(User, user_serializer(fields), envelope='data', options=user_load_options(fields),
+                         prepare=user_prepare(fields))
 
 
-@app.route('/users/<int:user_id>/favorites', methods=['GET'])
+@api.route('/users/<int:user_id>/favorites', methods=['GET'])
 def get_user_favorites(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"msg": "Usuario no existe"}), 404
+    return favorites_response(user_id)
 
-    return jsonify({
-        "people": [fav.people.serialize() for fav in user.favorite_people],
-        "starships": [fav.starship.serialize() for fav in user.favorite_starships],
-        "planets": [fav.planet.serialize() for fav in user.favorite_planets]
-        
-    }), 200
 
+@api.route('/users/<int:user_id>/favorites/bulk', methods=['POST'])
+def update_user_favorites(user_id):
+    return bulk_favorites(user_id)
 
-@app.route('/users/<int:user_id>', methods=['DELETE'])
+
+@api.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     user = User.query.filter_by(id=user_id).first()
     if user is None:
@@ -107,7 +176,7 @@ def delete_user(user_id):
 
 # PEOPLE
 
-@app.route('/people', methods=['POST'])
+@api.route('/people', methods=['POST'])
 def add_people():  # la informacion viene en el body de la request
     body = request.get_json(silent=True)
     if body is None:
@@ -126,26 +195,46 @@ def add_people():  # la informacion viene en el body de la request
     new_people.height = body['height']
 
     db.session.add(new_people)
+    db.session.flush()
+    publish(db.session.connection(), 'people', 'created', ids=[new_people.id])
     db.session.commit()
+    catalog_cache.invalidate(People.__tablename__)
 
     return jsonify({"msg": "Personaje agregado exitosamente"}), 201
 
 
-@app.route('/people', methods=['GET'])
+@api.route('/people/bulk', methods=['POST'])
+def add_people_bulk():
+    response = bulk_import(People)
+    catalog_cache.invalidate(People.__tablename__)
+    return response
+
+
+@api.route('/people', methods=['GET'])
+@conditional(People)
 def get_people():
-    people = People.query.all()
-    return jsonify([pe.serialize() for pe in people]), 200
+    if 'ids' in request.args:
+        return multi_get(People, parse_fields(People))
+    where, order = parse_query(People)
+    return list_response(People, fields=parse_fields(People), cache=catalog_cache, where=where, order=order)
+
 
+@api.route('/people/top', methods=['GET'])
+@conditional(People)
+def get_top_people():
+    return top_favorited(People)
 
-@app.route('/people/<int:people_id>', methods=['GET'])
+
+@api.route('/people/<int:people_id>', methods=['GET'])
+@conditional(People, 'people_id')
 def get_person(people_id):
-    person = People.query.get(people_id)
+    person = get_entity(People, people_id)
     if not person:
         return jsonify({"msg": "Personaje no encontrado"}), 404
-    return jsonify(person.serialize()), 200
+    return jsonify(person), 200
 
 
-@app.route('/favorite/people/<int:people_id>', methods=['POST'])
+@api.route('/favorite/people/<int:people_id>', methods=['POST'])
 def add_favorite_person(people_id):
     user = User.query.get(1)
     person = People.query.get(people_id)
@@ -153,26 +242,21 @@ def add_favorite_person(people_id):
     if not person:
         return jsonify({"msg": "Personaje no existe"}), 404
 
-    fav = FavoritePeople(user_id=user.id, people_id=people_id)
-    db.session.add(fav)
-    db.session.commit()
+    add_favorites(user.id, 'people', [people_id])
+    commit_favorites('people')
     return jsonify({"msg": "Personaje agregado a favoritos"}), 201
 
 
-@app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
+@api.route('/favorite/people/<int:people_id>', methods=['DELETE'])
 def delete_favorite_person(people_id):
-    fav = FavoritePeople.query.filter_by(
-        user_id=1, people_id=people_id).first()
-    if fav is None:
+    if not remove_favorites(1, 'people', [people_id]):
         return jsonify({"msg": "Favorito no encontrado"}), 404
-
-    db.session.delete(fav)
-    db.session.commit()
+    commit_favorites('people')
 
     return jsonify({"msg": "Favorito eliminado"}), 200
 
 # Starship
-@app.route('/starships', methods=['POST'])
+@api.route('/starships', methods=['POST'])
 def add_starship():
     body = request.get_json(silent=True)
     if body is None:
@@ -190,26 +274,46 @@ def add_starship():
     new_starship.speed = body['speed']
     
     db.session.add(new_starship)
+    db.session.flush()
+    publish(db.session.connection(), 'starships', 'created', ids=[new_starship.id])
     db.session.commit()
+    catalog_cache.invalidate(Starship.__tablename__)
 
     return jsonify({"msg": "Nave agregada exitosamente"}), 201
 
 
-@app.route('/starships/', methods=['GET'])
+@api.route('/starships/bulk', methods=['POST'])
+def add_starship_bulk():
+    response = bulk_import(Starship)
+    catalog_cache.invalidate(Starship.__tablename__)
+    return response
+
+
+@api.route('/starships/', methods=['GET'])
+@conditional(Starship)
 def get_starships():
-    starships = Starship.query.all()
-    return jsonify([v.serialize() for v in starships]), 200
+    if 'ids' in request.args:
+        return multi_get(Starship, parse_fields(Starship))
+    where, order = parse_query(Starship)
+    return list_response(Starship, fields=parse_fields(Starship), cache=catalog_cache, where=where, order=order)
+
 
+@api.route('/starships/top', methods=['GET'])
+@conditional(Starship)
+def get_top_starships():
+    return top_favorited(Starship)
 
-@app.route('/starships/<int:starships_id>', methods=['GET'])
+
+@api.route('/starships/<int:starship_id>', methods=['GET'])
+@conditional(Starship, 'starship_id')
 def get_starship(starship_id):
-    starship = Starship.query.get(starship_id)
+    starship = get_entity(Starship, starship_id)
     if not starship:
         return jsonify({"msg": "Nave no encontrada"}), 404
-    return jsonify(starship.serialize()), 200
+    return jsonify(starship), 200
 
 
-@app.route('/favorite/starship/<int:starship_id>', methods=['POST'])
+@api.route('/favorite/starship/<int:starship_id>', methods=['POST'])
 def add_favorite_starship(starship_id):
     user = User.query.get(1)
     starship = Starship.query.get(starship_id)
@@ -217,26 +321,22 @@ def add_favorite_starship(starship_id):
     if not starship:
         return jsonify({"msg": "Nave no existe"}), 404
 
-    fav = FavoriteStarships(user_id=user.id, starship_id=starship_id)
-    db.session.add(fav)
-    db.session.commit()
+    add_favorites(user.id, 'starships', [starship_id])
+    commit_favorites('starships')
     return jsonify({"msg": "Nave agregada a favoritos"}), 201
 
 
-@app.route('/favorite/ship/<int:starship_id>', methods=['DELETE'])
+@api.route('/favorite/ship/<int:starship_id>', methods=['DELETE'])
 def delete_favorite_starship(starship_id):
-    fav = FavoriteStarships.query.filter_by(
-        user_id=1, starship_id=starship_id).first()
-    if fav is None:
+    if not remove_favorites(1, 'starships', [starship_id]):
         return jsonify({"msg": "Favorito no encontrado"}), 404
-    db.session.delete(fav)
-    db.session.commit()
+    commit_favorites('starships')
     return jsonify({"msg": "Favorito eliminado"}), 200
 
 
 # PLANETS
 
-@app.route("/planets/", methods=['POST'])
+@api.route("/planets/", methods=['POST'])
 def add_planet():
     body = request.get_json(silent=True)
     if body is None:
@@ -258,26 +358,46 @@ def add_planet():
     new_planet.climate = body['climate']
 
     db.session.add(new_planet)
+    db.session.flush()
+    publish(db.session.connection(), 'planets', 'created', ids=[new_planet.id])
     db.session.commit()
+    catalog_cache.invalidate(Planet.__tablename__)
 
     return jsonify({"msg": "Planeta agregado exitosamente"}), 201
 
 
-@app.route('/planets', methods=['GET'])
+@api.route('/planets/bulk', methods=['POST'])
+def add_planet_bulk():
+    response = bulk_import(Planet)
+    catalog_cache.invalidate(Planet.__tablename__)
+    return response
+
+
+@api.route('/planets', methods=['GET'])
+@conditional(Planet)
 def get_planets():
-    planets = Planet.query.all()
-    return jsonify([p.serialize() for p in planets]), 200
+    if 'ids' in request.args:
+        return multi_get(Planet, parse_fields(Planet))
+    where, order = parse_query(Planet)
+    return list_response(Planet, fields=parse_fields(Planet), cache=catalog_cache, where=where, order=order)
+
+
+@api.route('/planets/top', methods=['GET'])
+@conditional(Planet)
+def get_top_planets():
+    return top_favorited(Planet)
 
 
-@app.route('/planets/<int:planet_id>', methods=['GET'])
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional(Planet, 'planet_id')
 def get_planet(planet_id):
-    planet = Planet.query.get(planet_id)
+    planet = get_entity(Planet, planet_id)
     if not planet:
         return jsonify({"msg": "Planeta no encontrado"}), 404
-    return jsonify(planet.serialize()), 200
+    return jsonify(planet), 200
 
 
-@app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
+@api.route('/favorite/planet/<int:planet_id>', methods=['POST'])
 def add_favorite_planet(planet_id):
     user = User.query.get(1)
     planet = Planet.query.get(planet_id)
@@ -285,22 +405,17 @@ def add_favorite_planet(planet_id):
     if not planet:
         return jsonify({"msg": "Planeta no existe"}), 404
 
-    fav = FavoritePlanets(user_id=user.id, planet_id=planet_id)
-    db.session.add(fav)
-    db.session.commit()
+    add_favorites(user.id, 'planets', [planet_id])
+    commit_favorites('planets')
 
     return jsonify({"msg": "Planeta agregado a favoritos"}), 201
 
 
-@app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
+@api.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 def delete_favorite_planet(planet_id):
-    fav = FavoritePlanets.query.filter_by(
-        user_id=1, planet_id=planet_id).first()
-    if fav is None:
+    if not remove_favorites(1, 'planets', [planet_id]):
         return jsonify({"msg": "Favorito no encontrado"}), 404
-
-    db.session.delete(fav)
-    db.session.commit()
+    commit_favorites('planets')
 
     return jsonify({"msg": "Vehículo eliminado de favoritos"}), 200
 
@@ -308,4 +423,4 @@ def delete_favorite_planet(planet_id):
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
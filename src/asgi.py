@@ -0,0 +1,467 @@
+"""
+ASGI entry point: serves the hot read endpoints with async handlers on SQLAlchemy's asyncio
+engine and hands every other request to the Flask app (src/app.py) on a worker thread.
+
+    uvicorn asgi:app --app-dir src --workers 2
+
+Needs `uvicorn` plus `aiosqlite` (SQLite) or `asyncpg` (Postgres), all in the Pipfile. The WSGI
+entry point (src/wsgi.py, gunicorn) keeps working unchanged.
+
+Async routes, for plain requests (no filters, sort, fields, stream or search parameters):
+    GET /people, /planets, /starships            keyset pages (`limit`, `after`)
+    GET /people/<id>, /planets/<id>, /starships/<id>
+    GET /users/<id>/favorites
+    GET /changes                                 change feed: SSE or long poll (see changes.py)
+Anything else, including parameter values the Flask route refuses, goes to Flask, and so do
+the catalog and favorites reads when CATALOG_SNAPSHOT or read replicas are configured (only the
+Flask app reads them) and the requests the query log reports on (querylog.py). Async requests
+are recorded in the /metrics histograms under the Flask route they stand for.
+
+Responses carry the same ETag, Last-Modified and CORS headers as the Flask routes and honour
+If-None-Match / If-Modified-Since. Entities and table versions are read through the catalog cache
+of the Flask routes; concurrent requests for the same page or missing entity are coalesced into
+one query (singleflight.AsyncSingleFlight).
+"""
+import asyncio
+import contextvars
+import hashlib
+import io
+import re
+import sys
+import time
+from datetime import timezone
+from urllib.parse import parse_qsl
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import http_date, parse_date
+from app import create_app
+from batch import NOT_FOUND
+from cache import catalog_cache
+from changes import ChangeFeed, DEFAULT_WAIT, MAX_WAIT, HEARTBEAT_INTERVAL, RETRY_MS, parse_after, parse_types, \
+    page_body, sse_body
+from compression import ENCODINGS, COMPRESS_MIN_SIZE, negotiate, compress
+from database import async_engine_options
+from ratelimit import get_limiter, client_key
+from metrics import registry, sample_rate, sampled, observe_request
+from querylog import logs_request
+from replicas import has_replicas
+from snapshot import snapshot_open
+from models import People, Planet, Starship, TableVersion, FavoritesDocument
+from pagination import DEFAULT_LIMIT, MAX_LIMIT
+from serializers import PUBLIC_FIELDS, dumps, row_serializer
+from utils import APIException
+from singleflight import AsyncSingleFlight
+
+COLLECTIONS = {'people': People, 'planets': Planet, 'starships': Starship}
+ASYNC_ARGS = {'limit', 'after'}
+_COLLECTION = re.compile(r'^/(people|planets|starships)/?$')
+_ENTITY = re.compile(r'^/(people|planets|starships)/(\d+)/?$')
+_FAVORITES = re.compile(r'^/users/(\d+)/favorites/?$')
+_CHANGES = re.compile(r'^/changes/?$')
+flights = AsyncSingleFlight()
+
+
+def async_database_url(url):
+    if url.startswith('postgres://') or url.startswith('postgresql://'):
+        return 'postgresql+asyncpg://' + url.split('://', 1)[1]
+    if url.startswith('sqlite://'):
+        return 'sqlite+aiosqlite://' + url.split('://', 1)[1]
+    return url
+
+
+flask_app = create_app()
+engine = create_async_engine(async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+                             **async_engine_options())
+changes = ChangeFeed(engine)
+# Only the Flask app reads the snapshot and the replicas (see the module docstring)
+FLASK_CATALOG_READS = snapshot_open() or has_replicas(flask_app)
+METRICS_SAMPLE_RATE = sample_rate()
+# SQL statements run for the measured request: [count, seconds]
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+class NotHandled(Exception):
+    """The request needs a feature only the Flask routes implement."""
+
+
+def _headers(scope):
+    return {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+
+
+async def _send(send, status, body=b'', headers=(), scope=None):
+    """Sends a JSON response, compressed as compression.py would when `scope` is given."""
+    headers = [(b'content-type', b'application/json'), *headers]
+    if scope is not None and ENCODINGS:
+        headers.append((b'vary', b'Accept-Encoding'))
+        encoding = negotiate(_headers(scope).get('accept-encoding'))
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            body = compress(encoding, body)
+            headers = [(key, b'W/' + value if key == b'etag' else value) for key, value in headers]
+            headers.append((b'content-encoding', encoding.encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _with_headers(send, extra):
+    """`send` adding `extra` headers to the response start."""
+    async def send_with_headers(message):
+        if message['type'] == 'http.response.start':
+            message = {**message, 'headers': [*message['headers'], *extra]}
+        await send(message)
+    return send_with_headers
+
+
+def _cors_headers(scope):
+    # What CORS(app) sends with its defaults: the request's origin, or * without one
+    return [(b'access-control-allow-origin', _headers(scope).get('origin', '*').encode('latin-1'))]
+
+
+def _validators(etag, updated_at):
+    headers = [(b'etag', etag.encode())]
+    if updated_at is not None:
+        headers.append((b'last-modified', http_date(updated_at).encode()))
+    return headers
+
+
+def _not_modified(scope, etag, updated_at):
+    """The checks of conditional._not_modified: If-None-Match first, then If-Modified-Since."""
+    headers = _headers(scope)
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return any(tag.strip().removeprefix('W/') in (etag, '*') for tag in if_none_match.split(','))
+    if_modified_since = parse_date(headers.get('if-modified-since'))
+    if if_modified_since is not None and updated_at is not None:
+        if updated_at.tzinfo is None:
+            # SQLite hands back naive datetimes, stored in UTC
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return updated_at.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+async def _table_version(model):
+    """
+    (version, updated_at) of the table, (0, None) before its first write, read through the
+    catalog cache under the key conditional.catalog_version uses for the primary.
+    """
+    key = (model.__tablename__, None, 'version')
+    cached = catalog_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = catalog_cache.generation
+    async with engine.connect() as connection:
+        row = (await connection.execute(select(TableVersion.version, TableVersion.updated_at)
+                                        .where(TableVersion.table_name == model.__tablename__))).first()
+    version = (row.version, row.updated_at) if row is not None else (0, None)
+    catalog_cache.set(key, version, generation)
+    return version
+
+
+def _limit_after(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+        after = int(args['after']) if args.get('after') else None
+    except ValueError:
+        raise NotHandled
+    if limit < 1:
+        # pagination.get_page_args answers the 400
+        raise NotHandled
+    return min(limit, MAX_LIMIT), after
+
+
+async def _load_page(model, limit, after):
+    """One encoded page plus whether there is a next one and the last id on it."""
+    fields = PUBLIC_FIELDS[model]
+    stmt = select(*(model.__table__.c[field] for field in fields)).order_by(model.id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    async with engine.connect() as connection:
+        rows = (await connection.execute(stmt)).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    serialize = row_serializer(model, fields)
+    return dumps([serialize(row) for row in rows]), has_next, rows[-1].id if rows else None
+
+
+async def list_collection(scope, send, model, args):
+    limit, after = _limit_after(args)
+    query_string = scope['query_string']
+    version, updated_at = await _table_version(model)
+    etag = f'"{model.__tablename__}-v{version}-{hashlib.sha1(query_string).hexdigest()[:12]}"'
+    if _not_modified(scope, etag, updated_at):
+        return await _send(send, 304, headers=_validators(etag, updated_at))
+    # Concurrent requests for the same page of the same table version share one query
+    body, has_next, last_id = await flights.do((model.__tablename__, 'page', version, limit, after),
+                                               lambda: _load_page(model, limit, after))
+
+    headers = _validators(etag, updated_at)
+    if has_next:
+        host = _headers(scope).get('host', 'localhost')
+        link = f'<{scope.get("scheme", "http")}://{host}{scope["path"]}?limit={limit}&after={last_id}>; rel="next"'
+        headers.append((b'link', link.encode()))
+    await _send(send, 200, body, headers, scope)
+
+
+async def _load_entity(model, entity_id):
+    """(serialized entity, row version), cached as cache.entity_entry caches it, or None."""
+    generation = catalog_cache.generation
+    fields = PUBLIC_FIELDS[model]
+    stmt = select(*(model.__table__.c[field] for field in fields), model.version).where(model.id == entity_id)
+    async with engine.connect() as connection:
+        row = (await connection.execute(stmt)).first()
+    if row is None:
+        return None
+    entry = (row_serializer(model, fields)(row), row.version)
+    catalog_cache.set((model.__tablename__, None, entity_id), entry, generation)
+    return entry
+
+
+async def get_entity(scope, send, kind, entity_id):
+    model = COLLECTIONS[kind]
+    entry = catalog_cache.get((model.__tablename__, None, entity_id))
+    if entry is None:
+        entry = await flights.do((model.__tablename__, entity_id), lambda: _load_entity(model, entity_id))
+        if entry is None:
+            return await _send(send, 404, dumps({"msg": NOT_FOUND[kind]}))
+    entity, version = entry
+    etag = f'"{model.__tablename__}-{entity_id}-v{version}"'
+    _, updated_at = await _table_version(model)
+    if _not_modified(scope, etag, updated_at):
+        return await _send(send, 304, headers=_validators(etag, updated_at))
+    await _send(send, 200, dumps(entity), _validators(etag, updated_at), scope)
+
+
+async def get_user_favorites(scope, send, user_id):
+    async with engine.connect() as connection:
+        document = await connection.scalar(
+            select(FavoritesDocument.document).where(FavoritesDocument.user_id == user_id))
+    if document is None:
+        # Unknown users and cleared documents (rebuilt on read) are left to the Flask route
+        raise NotHandled
+    await _send(send, 200, document.encode(), scope=scope)
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_changes(scope, send, receive, args):
+    """`GET /changes`: Server-Sent Events, or a long poll of up to `wait` seconds."""
+    headers = _headers(scope)
+    try:
+        after = parse_after(args.get('after', headers.get('last-event-id')))
+        types = parse_types(args.get('types'))
+        wait = min(max(int(args.get('wait', DEFAULT_WAIT)), 0), MAX_WAIT)
+    except (APIException, ValueError):
+        # The Flask route answers the error
+        raise NotHandled
+
+    if 'text/event-stream' not in headers.get('accept', ''):
+        async with changes.subscription():
+            events, after = await changes.wait(after, types, wait)
+        return await _send(send, 200, page_body(events, after).encode(), scope=scope)
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        async with changes.subscription():
+            while not disconnected.done():
+                events, after = await changes.wait(after, types, HEARTBEAT_INTERVAL, stop=disconnected)
+                if not disconnected.done():
+                    body = sse_body(events) if events else ': keepalive\n\n'
+                    await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+
+
+async def _rate_limited(scope, send, group):
+    """
+    Applies the rate limit of `group` as the Flask app would. Returns the `send` to answer
+    with, adding the RateLimit-* headers, or None once a 429 has been sent.
+    """
+    limiter = get_limiter()
+    if limiter is None:
+        return send
+    headers = _headers(scope)
+    client = client_key(headers.get('x-api-key'), (scope.get('client') or ('',))[0], headers.get('x-forwarded-for'))
+    decision = limiter.hit(group, client)
+    # A handler may still raise NotHandled: the Flask app then reuses this decision instead of
+    # charging the request a second time (see ratelimit.check_rate_limit)
+    scope['ratelimit.decision'] = decision
+    extra = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in decision.headers().items()]
+    if not decision.allowed:
+        message = f"Demasiadas solicitudes, intente de nuevo en {decision.headers()['Retry-After']} segundos"
+        await _send(send, 429, dumps({"msg": message}), extra)
+        return None
+    return _with_headers(send, extra)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _request_queries.get() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _request_queries.get()
+    start = getattr(context, 'metrics_start', None)
+    if queries is None or start is None:
+        return
+    elapsed = time.perf_counter() - start
+    queries[0] += 1
+    queries[1] += elapsed
+    registry.observe('db_query_duration_seconds', elapsed, route=queries[2])
+
+
+def _route(path):
+    """The rule of the Flask route serving `path`, the route label of metrics.py."""
+    try:
+        rule, _ = flask_app.url_map.bind('localhost').match(path, method='GET', return_rule=True)
+    except Exception:
+        return 'unmatched'
+    return rule.rule
+
+
+def _measured(scope, send):
+    """`send` recording the request in the /metrics histograms once its response is complete."""
+    route = _route(scope['path'])
+    queries = [0, 0.0, route]
+    _request_queries.set(queries)
+    start = time.perf_counter()
+    response = {'size': 0, 'streamed': False}
+
+    async def send_measured(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['size'] += len(message.get('body', b''))
+            response['streamed'] = response['streamed'] or message.get('more_body', False)
+        await send(message)
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            observe_request(scope['method'], route, response['status'], time.perf_counter() - start, queries[0],
+                            None if response['streamed'] else response['size'])
+    return send_measured
+
+
+async def handle_async(scope, receive, send):
+    """Serves the request with an async handler, raising NotHandled when Flask must answer it."""
+    if scope['method'] != 'GET' or logs_request(flask_app, _headers(scope).get('x-debug-queries')):
+        raise NotHandled
+    args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    path = scope['path']
+    if _CHANGES.match(path):
+        handler, group, handler_args = stream_changes, 'list', (receive, args)
+    elif FLASK_CATALOG_READS or set(args) - ASYNC_ARGS:
+        raise NotHandled
+    elif match := _COLLECTION.match(path):
+        handler, group, handler_args = list_collection, 'list', (COLLECTIONS[match.group(1)], args)
+    elif args:
+        raise NotHandled
+    elif match := _ENTITY.match(path):
+        handler, group, handler_args = get_entity, 'default', (match.group(1), int(match.group(2)))
+    elif match := _FAVORITES.match(path):
+        handler, group, handler_args = get_user_favorites, 'default', (int(match.group(1)),)
+    else:
+        raise NotHandled
+    send = _with_headers(send, _cors_headers(scope))
+    if METRICS_SAMPLE_RATE > 0 and sampled(METRICS_SAMPLE_RATE):
+        send = _measured(scope, send)
+    send = await _rate_limited(scope, send, group)
+    if send is not None:
+        await handler(scope, send, *handler_args)
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if 'ratelimit.decision' in scope:
+        environ['ratelimit.decision'] = scope['ratelimit.decision']
+    for name, value in _headers(scope).items():
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def call_wsgi(scope, receive, send):
+    """Runs the Flask app on a worker thread, relaying its (possibly streamed) body chunk by chunk."""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]
+
+    # Every step runs in the same context so Flask's context variables survive between
+    # the call and the iteration of a streamed body, even across worker threads
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+
+    def run(func, *args):
+        return loop.run_in_executor(None, context.run, func, *args)
+
+    result = await run(flask_app, _wsgi_environ(scope, body), start_response)
+    iterator = iter(result)
+    try:
+        chunk = await run(next, iterator, None)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await run(next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await run(result.close)
+
+
+if METRICS_SAMPLE_RATE > 0:
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    try:
+        await handle_async(scope, receive, send)
+    except NotHandled:
+        await call_wsgi(scope, receive, send)
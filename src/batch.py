@@ -0,0 +1,125 @@
+"""
+Multi-get of catalog entities (People, Planet, Starship): `GET /people?ids=1,2,3` and `POST /batch`
+with mixed (type, id) pairs.
+
+Ids are resolved through a per-request identity map, then the catalog cache, and whatever is left
+with one `IN (...)` query per table. Results come back in request order, one item per
+requested id: {"id", "status": 200, "data"} or {"id", "status": 404, "msg"}.
+"""
+from flask import g, request, jsonify
+from sqlalchemy import select
+from utils import APIException
+from cache import catalog_cache
+from replicas import read_bind
+from serializers import PUBLIC_FIELDS, row_serializer
+from models import db, People, Planet, Starship
+
+MAX_BATCH_SIZE = 100
+BATCH_TYPES = {'people': People, 'planets': Planet, 'starships': Starship}
+NOT_FOUND = {'people': "Personaje no encontrado", 'planets': "Planeta no encontrado", 'starships': "Nave no encontrada"}
+_TYPE_OF = {model: kind for kind, model in BATCH_TYPES.items()}
+
+
+def _identity_map():
+    if 'identity_map' not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
+def resolve(model, ids):
+    """
+    Serialized entities by id ({id: dict or None}), each table queried at most once per call
+    and each entity at most once per request.
+    """
+    identity_map = _identity_map()
+    pending = {entity_id for entity_id in ids if (model, entity_id) not in identity_map}
+
+    if pending:
+        # Cache entries are (entity, row version) under the keys of cache.entity_entry
+        bind = read_bind()
+        missing = set()
+        for entity_id in pending:
+            cached = catalog_cache.get((model.__tablename__, bind, entity_id))
+            if cached is None:
+                missing.add(entity_id)
+            else:
+                identity_map[(model, entity_id)] = cached[0]
+
+        if missing:
+            fields = PUBLIC_FIELDS[model]
+            serialize = row_serializer(model, fields)
+            generation = catalog_cache.generation
+            stmt = select(*(model.__table__.c[field] for field in fields), model.version).where(model.id.in_(missing))
+            for row in db.session.execute(stmt):
+                entity = serialize(row)
+                identity_map[(model, entity['id'])] = entity
+                catalog_cache.set((model.__tablename__, bind, entity['id']), (entity, row.version), generation)
+                missing.discard(entity['id'])
+            for entity_id in missing:
+                identity_map[(model, entity_id)] = None
+
+    return {entity_id: identity_map[(model, entity_id)] for entity_id in ids}
+
+
+def _item(kind, entity_id, entity, fields, with_type=False):
+    item = {'type': kind} if with_type else {}
+    item['id'] = entity_id
+    if entity is None:
+        item.update(status=404, msg=NOT_FOUND[kind])
+    else:
+        item.update(status=200, data={field: entity[field] for field in fields})
+    return item
+
+
+def parse_ids(raw):
+    try:
+        ids = [int(part) for part in raw.split(',') if part.strip()]
+    except ValueError:
+        raise APIException("'ids' debe ser una lista de números enteros separados por comas", status_code=400)
+    if not ids:
+        raise APIException("Debe enviar al menos un id en 'ids'", status_code=400)
+    if len(ids) > MAX_BATCH_SIZE:
+        raise APIException(f"Se permiten como máximo {MAX_BATCH_SIZE} ids por solicitud", status_code=400)
+    return ids
+
+
+def multi_get(model, fields):
+    """`GET /<collection>?ids=1,2,3`: one item per requested id, in request order."""
+    ids = parse_ids(request.args['ids'])
+    kind = _TYPE_OF[model]
+    entities = resolve(model, ids)
+    return jsonify([_item(kind, entity_id, entities[entity_id], fields) for entity_id in ids]), 200
+
+
+def _parse_pair(pair):
+    if isinstance(pair, dict):
+        kind, entity_id = pair.get('type'), pair.get('id')
+    elif isinstance(pair, list) and len(pair) == 2:
+        kind, entity_id = pair
+    else:
+        raise APIException("Cada elemento debe ser {\"type\", \"id\"} o [type, id]", status_code=400)
+    if kind not in BATCH_TYPES:
+        raise APIException(f"Tipo desconocido: '{kind}'", status_code=400)
+    if not isinstance(entity_id, int) or isinstance(entity_id, bool):
+        raise APIException("Los ids deben ser números enteros", status_code=400)
+    return kind, entity_id
+
+
+def batch_get():
+    """
+    `POST /batch` with a list of (type, id) pairs, e.g. [{"type": "people", "id": 1}, ["planets", 3]],
+    answered in request order.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, list) or not body:
+        return jsonify({"msg": "Debe enviar una lista de pares (type, id)"}), 400
+    if len(body) > MAX_BATCH_SIZE:
+        raise APIException(f"Se permiten como máximo {MAX_BATCH_SIZE} elementos por solicitud", status_code=400)
+    pairs = [_parse_pair(pair) for pair in body]
+
+    requested = {}
+    for kind, entity_id in pairs:
+        requested.setdefault(kind, []).append(entity_id)
+    entities = {kind: resolve(BATCH_TYPES[kind], ids) for kind, ids in requested.items()}
+    return jsonify([_item(kind, entity_id, entities[kind][entity_id], PUBLIC_FIELDS[BATCH_TYPES[kind]], with_type=True)
+                    for kind, entity_id in pairs]), 200
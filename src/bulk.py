@@ -0,0 +1,123 @@
+"""
+Bulk import of catalog entities (People, Planet, Starship) from a JSON array or an NDJSON stream
+"""
+import json
+import os
+from flask import request, jsonify
+from sqlalchemy import insert, BigInteger, Integer, SmallInteger
+from utils import APIException
+from changes import publish, CATALOG_CHANGE_TYPES
+from models import db, People, Planet, Starship, GenderEnum, bump_table_version, names_version
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+# Required fields of every catalog entity and the type each value must have
+CATALOG_FIELDS = {
+    People: {'name': str, 'gender': GenderEnum, 'height': int},
+    Planet: {'name': str, 'size': int, 'population': int, 'climate': str},
+    Starship: {'name': str, 'cost_in_credits': int, 'speed': int}
+}
+# Signed range of the integer column types (PostgreSQL's int2/int4/int8): a value out of range
+# fails the whole chunk's INSERT, so it is reported as a row error instead
+INTEGER_BITS = ((SmallInteger, 16), (BigInteger, 64), (Integer, 32))
+
+
+def read_rows():
+    """Yields (index, row, error) from a JSON array body or, line by line, from an NDJSON body."""
+    if request.mimetype == 'application/x-ndjson':
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError:
+                yield index, None, "JSON inválido"
+            index += 1
+        return
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        raise APIException("Debe enviar una lista de elementos o un stream NDJSON", status_code=400)
+    for index, row in enumerate(body):
+        yield index, row, None
+
+
+def _in_range(column_type, value):
+    for integer_type, bits in INTEGER_BITS:
+        if isinstance(column_type, integer_type):
+            return -2 ** (bits - 1) <= value < 2 ** (bits - 1)
+    return True
+
+
+def _coerce(column, kind, value):
+    if kind is int:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError
+        value = int(value)
+        if not _in_range(column.type, value):
+            raise ValueError
+        return value
+    if kind is GenderEnum:
+        return GenderEnum(value) if value in GenderEnum._value2member_map_ else GenderEnum[value]
+    if not isinstance(value, str) or not value:
+        raise ValueError
+    if column.type.length is not None and len(value) > column.type.length:
+        raise ValueError
+    return value
+
+
+def validate_row(model, row):
+    """Returns (values, None) for a valid row or (None, message) explaining why it is not."""
+    if not isinstance(row, dict):
+        return None, "Cada elemento debe ser un objeto"
+    values = {}
+    for field, kind in CATALOG_FIELDS[model].items():
+        if field not in row:
+            return None, f"Es obligatorio el campo '{field}'"
+        try:
+            values[field] = _coerce(model.__table__.columns[field], kind, row[field])
+        except (ValueError, KeyError, TypeError):
+            return None, f"Valor inválido para el campo '{field}'"
+    return values, None
+
+
+def _insert_chunk(model, chunk):
+    # One executemany INSERT and one transaction per chunk
+    connection = db.session.connection()
+    if connection.dialect.insert_executemany_returning:
+        ids = db.session.execute(insert(model).returning(model.id), chunk).scalars().all()
+        change = {'ids': ids}
+    else:
+        db.session.execute(insert(model), chunk)
+        change = {'count': len(chunk)}
+    bump_table_version(connection, model.__tablename__)
+    bump_table_version(connection, names_version(model.__tablename__))
+    publish(connection, CATALOG_CHANGE_TYPES[model], 'created', **change)
+    db.session.commit()
+
+
+def bulk_import(model):
+    """Validates the rows in a single pass and inserts the valid ones in chunked transactions."""
+    inserted = 0
+    errors = []
+    chunk = []
+    for index, row, error in read_rows():
+        values = None
+        if error is None:
+            values, error = validate_row(model, row)
+        if error is not None:
+            errors.append({"row": index, "msg": error})
+            continue
+        chunk.append(values)
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            _insert_chunk(model, chunk)
+            inserted += len(chunk)
+            chunk = []
+    if chunk:
+        _insert_chunk(model, chunk)
+        inserted += len(chunk)
+
+    status = 400 if errors and not inserted else 201
+    return jsonify({"inserted": inserted, "errors": errors}), status
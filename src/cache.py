@@ -0,0 +1,156 @@
+"""
+Bounded in-process LRU/TTL cache for the catalog (People, Planet, Starship) reads.
+Misses are loaded through singleflight, so concurrent requests for the same expired key share one load.
+A hit runs no query: entries are dropped by the writes of this process (invalidate) and expire
+after the TTL, which bounds how long a write made through another worker process goes unseen.
+Entities are cached with the row version they were read at and the table versions are cached
+too, so the ETag of a response is derived from the cached value it is sent with
+(conditional.catalog_version). Keys hold the bind the request reads from (replicas.read_bind).
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from flask import g, jsonify
+from models import db
+from singleflight import flights
+from replicas import read_bind
+from serializers import PUBLIC_FIELDS
+from snapshot import served_table
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    Keys are tuples whose first element is a namespace (the table name),
+    so every entry of a table can be invalidated at once after a write.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        # Bumped by every invalidation, so loads started before one are neither joined nor cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    @property
+    def generation(self):
+        """Pass it to set() when loading outside get_or_load, read before the load starts."""
+        return self._generation
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value or calls `loader()` and caches its result unless it is None.
+        Concurrent misses of the same key wait for a single `loader()` call and share its result.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            generation = self._generation
+            value = flights.do(key, lambda: self._load(key, loader, generation), epoch=generation)
+        return value
+
+    def _load(self, key, loader, generation):
+        with self._lock:
+            # Another flight may have filled the key between our miss and taking the lead
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return entry[1]
+        value = loader()
+        if value is not None:
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._data if k[0] == namespace]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+catalog_cache = LRUCache(
+    maxsize=int(os.environ.get('CATALOG_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', 60)))
+
+
+def entity_entry(model, entity_id):
+    """
+    (serialized entity, row version) by id, read through the cache and kept for the rest of the
+    request (None when it does not exist).
+    """
+    entries = g.setdefault('catalog_entities', {})
+    key = (model.__tablename__, read_bind(), entity_id)
+    if key not in entries:
+        def load():
+            table = served_table(model)
+            if table is not None:
+                row = table.get(entity_id, (*PUBLIC_FIELDS[model], 'version'))
+                if row is None:
+                    return None
+                version = row.pop('version')
+                return row, version
+            entity = db.session.get(model, entity_id)
+            return (entity.serializable(), entity.version) if entity else None
+        entries[key] = catalog_cache.get_or_load(key, load)
+    return entries[key]
+
+
+def get_entity(model, entity_id):
+    """Serialized catalog entity by id, read through the cache (None when it does not exist)."""
+    entry = entity_entry(model, entity_id)
+    return entry[0] if entry is not None else None
+
+
+def setup_cache(app):
+    @app.route('/cache/stats', methods=['GET'])
+    def cache_stats():
+        return jsonify({**catalog_cache.stats(), "singleflight": flights.stats()}), 200
@@ -0,0 +1,237 @@
+"""
+Change feed of the API writes: new people, planets and starships, and favorites added or removed.
+
+The write handlers publish() an event into the append-only change_log table in the same
+transaction as the write:
+
+    {"id", "type": "people" | "planets" | "starships", "action": "created", "ids"}
+    {"id", "type": "favorites", "action": "added" | "removed", "user_id", "kind", "ids"}
+
+(bulk imports on databases without executemany RETURNING log a "count" instead of the ids).
+Event ids only grow, so a client resumes from the last id it saw (`Last-Event-ID` header or
+`after=`) and filters with `types=people,favorites`.
+
+    GET /changes    src/asgi.py: Server-Sent Events (Accept: text/event-stream), or a long poll
+                    answering as soon as there are events or after `wait` seconds (default 30)
+                    src/app.py (WSGI): answers at once with the events already logged
+                    Every answer but SSE is {"events": [...], "last_event_id": N}
+
+    CHANGES_POLL_INTERVAL   seconds between two reads of the log by a process's feed (default 0.5)
+    CHANGES_RETENTION_DAYS  `flask changes prune` removes older events (default 7)
+
+Under asgi.py a single ChangeFeed task per process reads the log and wakes every subscriber, so
+an idle client costs a suspended coroutine, not a thread or a query. Transactions can commit
+their ids out of order: an event after a missing id is held back until the gap fills, or for
+GAP_WAIT seconds when the missing id was rolled back.
+"""
+import asyncio
+import bisect
+import contextlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+import click
+from flask import request, Response
+from sqlalchemy import select, insert, delete, func
+from utils import APIException
+from models import db, People, Planet, Starship, ChangeLog
+
+CHANGE_TYPES = ('people', 'planets', 'starships', 'favorites')
+CATALOG_CHANGE_TYPES = {People: 'people', Planet: 'planets', Starship: 'starships'}
+CHANGES_POLL_INTERVAL = float(os.environ.get('CHANGES_POLL_INTERVAL', 0.5))
+CHANGES_RETENTION_DAYS = int(os.environ.get('CHANGES_RETENTION_DAYS', 7))
+CHANGES_PAGE_SIZE = 500
+CHANGES_BUFFER_SIZE = 5000
+GAP_WAIT = 5
+DEFAULT_WAIT = 30
+MAX_WAIT = 60
+HEARTBEAT_INTERVAL = 15
+RETRY_MS = 2000
+
+logger = logging.getLogger(__name__)
+
+
+def publish(connection, change_type, action, **data):
+    """Logs an event in the caller's transaction. Call it right before committing the write."""
+    connection.execute(insert(ChangeLog).values(
+        type=change_type,
+        data=json.dumps({'type': change_type, 'action': action, **data}, separators=(',', ':')),
+        created_at=datetime.now(timezone.utc)))
+
+
+def parse_after(value):
+    if value is None or value == '':
+        return None
+    try:
+        after = int(value)
+    except ValueError:
+        after = -1
+    if after < 0:
+        raise APIException("El id del último evento debe ser un número entero", status_code=400)
+    return after
+
+
+def parse_types(value):
+    """The requested change types, or None for all of them."""
+    if not value:
+        return None
+    types = {item.strip() for item in value.split(',') if item.strip()}
+    unknown = sorted(types - set(CHANGE_TYPES))
+    if unknown:
+        raise APIException(f"Tipo de cambio desconocido: '{unknown[0]}'", status_code=400)
+    return types
+
+
+def latest_statement():
+    return select(func.coalesce(func.max(ChangeLog.id), 0))
+
+
+def events_statement(after, limit=CHANGES_PAGE_SIZE):
+    return (select(ChangeLog.id, ChangeLog.type, ChangeLog.data, ChangeLog.created_at)
+            .where(ChangeLog.id > after).order_by(ChangeLog.id).limit(limit))
+
+
+def _age(created_at, now):
+    if created_at.tzinfo is None:
+        # SQLite hands back naive datetimes, stored in UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (now - created_at).total_seconds()
+
+
+def visible_events(rows, after):
+    """
+    (id, type, JSON) of the log rows (ordered by id) that can be handed out after `after`:
+    everything up to the first gap in the ids that may still be filled by a running transaction.
+    """
+    now = datetime.now(timezone.utc)
+    events = []
+    for row in rows:
+        if row.id != after + 1 and _age(row.created_at, now) < GAP_WAIT:
+            break
+        events.append((row.id, row.type, f'{{"id":{row.id},{row.data[1:]}'))
+        after = row.id
+    return events
+
+
+def matching(events, types):
+    return events if types is None else [event for event in events if event[1] in types]
+
+
+def page_body(events, last_event_id):
+    return f'{{"events":[{",".join(event[2] for event in events)}],"last_event_id":{last_event_id}}}'
+
+
+def sse_body(events):
+    return ''.join(f'id: {event_id}\ndata: {data}\n\n' for event_id, _, data in events)
+
+
+def changes_page():
+    """`GET /changes` on the WSGI app: the events already logged after the client's id, without waiting."""
+    after = parse_after(request.args.get('after', request.headers.get('Last-Event-ID')))
+    types = parse_types(request.args.get('types'))
+    if after is None:
+        events, cursor = [], db.session.scalar(latest_statement())
+    else:
+        events = visible_events(db.session.execute(events_statement(after)), after)
+        cursor = events[-1][0] if events else after
+    return Response(page_body(matching(events, types), cursor), mimetype='application/json'), 200
+
+
+class ChangeFeed:
+    """
+    Reads the log every CHANGES_POLL_INTERVAL for all the subscribers of the process, while there
+    is at least one, keeping the latest events in memory and waking the subscribers on new ones.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.events = []
+        # Every event up to this id is in `events` or older than its first one
+        self.horizon = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = None
+
+    async def _read(self, after):
+        async with self.engine.connect() as connection:
+            if after is None:
+                return [], await connection.scalar(latest_statement())
+            rows = (await connection.execute(events_statement(after))).all()
+        events = visible_events(rows, after)
+        return events, events[-1][0] if events else after
+
+    async def _poll(self):
+        try:
+            while self.subscribers:
+                try:
+                    events, self.horizon = await self._read(self.horizon)
+                except Exception:
+                    logger.exception('Could not read the change log')
+                    events = []
+                if events:
+                    self.events.extend(events)
+                    if len(self.events) > 2 * CHANGES_BUFFER_SIZE:
+                        del self.events[:-CHANGES_BUFFER_SIZE]
+                    self._changed.set()
+                    self._changed = asyncio.Event()
+                if len(events) < CHANGES_PAGE_SIZE:
+                    await asyncio.sleep(CHANGES_POLL_INTERVAL)
+        finally:
+            self._task = None
+
+    @contextlib.asynccontextmanager
+    async def subscription(self):
+        self.subscribers += 1
+        try:
+            if self._task is None:
+                # Starting (again): whatever happened while nobody listened is not in the buffer
+                _, horizon = await self._read(None)
+                if self._task is None:
+                    self.events.clear()
+                    self.horizon = horizon
+                    self._task = asyncio.get_running_loop().create_task(self._poll())
+            yield self
+        finally:
+            self.subscribers -= 1
+
+    async def read(self, after, types):
+        """Events of `types` after `after` (None: from now on) and the id to continue from."""
+        if after is None or after >= self.horizon:
+            return [], self.horizon if after is None else after
+        if self.events and after >= self.events[0][0] - 1:
+            start = bisect.bisect_right(self.events, after, key=lambda event: event[0])
+            return matching(self.events[start:], types), self.horizon
+        # Older than the buffer: the backlog comes from the log, a page at a time
+        events, cursor = await self._read(after)
+        return matching(events, types), cursor
+
+    async def wait(self, after, types, timeout, stop=None):
+        """Like read(), waiting up to `timeout` seconds for events unless `stop` completes first."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            events, after = await self.read(after, types)
+            remaining = deadline - loop.time()
+            if events or remaining <= 0 or (stop is not None and stop.done()):
+                return events, after
+            changed = asyncio.ensure_future(self._changed.wait())
+            await asyncio.wait({changed, stop} if stop is not None else {changed}, timeout=remaining,
+                               return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+
+
+def setup_changes(app):
+    @app.cli.group('changes')
+    def changes_cli():
+        """Change feed log."""
+
+    @changes_cli.command('prune')
+    @click.option('--days', type=int, default=CHANGES_RETENTION_DAYS, show_default=True,
+                  help='Keep the events of the last DAYS days.')
+    def prune_command(days):
+        """Removes old events from the change log."""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        result = db.session.execute(delete(ChangeLog).where(ChangeLog.created_at < cutoff))
+        db.session.commit()
+        click.echo(f'{result.rowcount} events removed')
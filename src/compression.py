@@ -0,0 +1,173 @@
+"""
+Response compression negotiated from `Accept-Encoding`: zstd, br and gzip, in that order of
+preference when the client accepts several with the same q-value.
+
+    COMPRESS_MIN_SIZE      bodies smaller than this many bytes are sent as they are (default 1024)
+    COMPRESS_ENCODINGS     encodings offered, most preferred first (default zstd,br,gzip)
+
+gzip comes with the standard library; br needs `brotli` and zstd needs `zstandard`, and an
+encoding whose package is missing is simply not offered. Streamed responses are compressed
+chunk by chunk, flushed every STREAM_FLUSH_SIZE bytes so clients can decode as rows arrive.
+Responses carrying a `Payload` reuse the compressed bytes it keeps, so a cached page is
+compressed once per encoding instead of once per request.
+"""
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/html', 'text/plain'}
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# encoding -> (streaming compressor, level per request, level for bodies compressed once and kept)
+CODECS = {'gzip': (_Gzip, 6, 9)}
+if brotli is not None:
+    CODECS['br'] = (_Brotli, 4, 9)
+if zstandard is not None:
+    CODECS['zstd'] = (_Zstd, 3, 12)
+ENCODINGS = [encoding.strip() for encoding in os.environ.get('COMPRESS_ENCODINGS', 'zstd,br,gzip').split(',')
+             if encoding.strip() in CODECS]
+
+
+def negotiate(accept_encoding):
+    """The offered encoding the client prefers, or None when it accepts none of them."""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding, data, keep=False):
+    codec, level, keep_level = CODECS[encoding]
+    compressor = codec(keep_level if keep else level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(encoding, chunks):
+    codec, level, _ = CODECS[encoding]
+    compressor = codec(level)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_SIZE:
+            data += compressor.flush()
+            pending = 0
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class Payload:
+    """An encoded response body plus its compressed variants, each built on first use and kept with it."""
+    __slots__ = ('body', '_compressed')
+
+    def __init__(self, body):
+        self.body = body
+        self._compressed = {}
+
+    def compressed(self, encoding):
+        data = self._compressed.get(encoding)
+        if data is None:
+            data = self._compressed[encoding] = compress(encoding, self.body, keep=True)
+        return data
+
+
+def _compressible(response):
+    return (response.status_code == 200 and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and 'no-transform' not in response.headers.get('Cache-Control', ''))
+
+
+def setup_compression(app):
+    if not ENCODINGS:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(encoding, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            payload = getattr(response, 'payload', None)
+            body = payload.body if payload is not None else response.get_data()
+            if len(body) < COMPRESS_MIN_SIZE:
+                return response
+            response.set_data(payload.compressed(encoding) if payload is not None else compress(encoding, body))
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity ones, so the validator can only be weak
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
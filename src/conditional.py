@@ -0,0 +1,84 @@
+"""
+HTTP conditional requests (ETag / Last-Modified / 304) for the catalog reads
+"""
+import hashlib
+from functools import wraps
+from flask import g, request, make_response
+from models import get_table_version
+from cache import catalog_cache, entity_entry
+from replicas import read_bind
+
+
+def _table_version(model):
+    """(version, updated_at) of the table, read through the catalog cache once per request."""
+    versions = g.setdefault('catalog_versions', {})
+    name = model.__tablename__
+    if name not in versions:
+        versions[name] = catalog_cache.get_or_load((name, read_bind(), 'version'), lambda: get_table_version(name))
+    return versions[name]
+
+
+def catalog_version(model, entity_id=None):
+    """
+    Version of the table, or with `entity_id` of the entity's row (None when it does not exist).
+    Both come from the catalog cache, without a query on a hit, and stay the same for the rest of
+    the request: the ETag of a response is the version of the cached body it is sent with.
+    """
+    if entity_id is None:
+        return _table_version(model)[0]
+    entry = entity_entry(model, entity_id)
+    return entry[1] if entry is not None else None
+
+
+def collection_etag(model):
+    version, updated_at = _table_version(model)
+    # The same collection is served differently depending on the query string (page, stream...)
+    args = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return f'{model.__tablename__}-v{version}-{args}', updated_at
+
+
+def entity_etag(model, entity_id):
+    version = catalog_version(model, entity_id)
+    if version is None:
+        return None, None
+    _, updated_at = _table_version(model)
+    return f'{model.__tablename__}-{entity_id}-v{version}', updated_at
+
+
+def _not_modified(etag, updated_at):
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry the weak form of the same tag
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and updated_at is not None:
+        return updated_at.replace(microsecond=0, tzinfo=request.if_modified_since.tzinfo) <= request.if_modified_since
+    return False
+
+
+def conditional(model, id_arg=None):
+    """
+    Answers `If-None-Match` / `If-Modified-Since` with 304 from the version counters alone,
+    before the view loads or serializes any row, and tags fresh responses with a strong ETag.
+    `id_arg` names the URL variable holding the entity id for single-entity routes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if id_arg is None:
+                etag, updated_at = collection_etag(model)
+            else:
+                etag, updated_at = entity_etag(model, kwargs[id_arg])
+                if etag is None:
+                    return view(*args, **kwargs)
+
+            if _not_modified(etag, updated_at):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if updated_at is not None:
+                response.last_modified = updated_at
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+"""
+Engine and connection-pool configuration from environment variables, pool checkout-wait
+metrics and the /healthz readiness probe.
+
+    DB_POOL_SIZE             connections kept open per worker process (default 5)
+    DB_MAX_OVERFLOW          extra connections allowed under bursts (default 10)
+    DB_POOL_TIMEOUT          seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE          seconds after which a connection is replaced (default 1800)
+    DB_POOL_PRE_PING         1 to test connections on checkout, surviving idle disconnects (default 1)
+    DB_STATEMENT_TIMEOUT_MS  Postgres statement_timeout for every connection (default: none)
+    DB_PGBOUNCER             1 when connecting through PgBouncer in transaction mode: no
+                             client-side pool and no server-side prepared statements
+    DB_POOL_SATURATION_THRESHOLD  share of the pool in use above which /healthz fails (default 0.9)
+"""
+import logging
+import os
+import time
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, NullPool
+from metrics import registry, LATENCY_BUCKETS
+from models import db
+from replicas import router
+
+logger = logging.getLogger(__name__)
+
+registry.describe('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.', LATENCY_BUCKETS)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def pgbouncer_mode():
+    return os.environ.get('DB_PGBOUNCER') == '1'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long every checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds', time.perf_counter() - start)
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at `url`."""
+    if url.startswith('sqlite') and ':memory:' in url:
+        return {}
+    options = {'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1'}
+    if pgbouncer_mode():
+        # PgBouncer owns the pooling; psycopg 3 would otherwise prepare statements server-side
+        options['poolclass'] = NullPool
+        if url.startswith('postgresql+psycopg:'):
+            options['connect_args'] = {'prepare_threshold': None}
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=_env_int('DB_POOL_SIZE', 5),
+        max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+        pool_timeout=_env_int('DB_POOL_TIMEOUT', 30),
+        pool_recycle=_env_int('DB_POOL_RECYCLE', 1800))
+    statement_timeout = os.environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+
+def async_engine_options():
+    """Pool options for the asyncpg / aiosqlite engine of src/asgi.py."""
+    if pgbouncer_mode():
+        return {'poolclass': NullPool, 'connect_args': {'statement_cache_size': 0}}
+    return {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_size': _env_int('ASYNC_POOL_SIZE', 20),
+        'max_overflow': _env_int('ASYNC_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+    }
+
+
+def pool_status(pool):
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    capacity = pool.size() + pool._max_overflow
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(pool.checkedout() / capacity, 3) if capacity > 0 else 0
+    }
+
+
+def setup_healthz(app):
+    threshold = float(os.environ.get('DB_POOL_SATURATION_THRESHOLD', 0.9))
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        try:
+            db.session.execute(text('SELECT 1'), bind_arguments={'bind': db.engine})
+        except Exception:  # any driver error means the database is not reachable
+            # The driver's message can name the host or user: it goes to the log, not to the public probe
+            logger.exception('Health check query failed')
+            return jsonify({"status": "unavailable", **pool_status(db.engine.pool)}), 503
+        status = pool_status(db.engine.pool)
+        if router.status():
+            status['replica_lag_seconds'] = router.status()
+        if status.get('saturation', 0) >= threshold:
+            return jsonify({"status": "saturated", **status}), 503
+        return jsonify({"status": "ok", **status}), 200
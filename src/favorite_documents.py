@@ -0,0 +1,153 @@
+"""
+Materialized favorites documents: each user's favorites ({"people": [...], "starships": [...],
+"planets": [...]}) kept serialized in user_favorites_document, so reading them is one primary
+key lookup instead of three joins.
+
+The favorites writes of favorites.py patch the document in their own transaction. ORM writes
+to the favorites tables (the admin UI) and edits of favorited entities clear the documents they
+affect (models.py), and the next read rebuilds them, a page of users at a time for /users.
+`flask favorites rebuild` rebuilds every document, e.g. after restoring a backup or changing
+DOCUMENT_FIELDS; with --missing only the cleared ones, which the release step runs after the
+migrations so a deploy does not start with every document to build.
+"""
+import json
+import click
+from flask import g, Response, jsonify
+from sqlalchemy import select, update, bindparam
+from models import db, User, FavoritesDocument, FavoritePeople, FavoriteStarships, FavoritePlanets, \
+    FAVORITE_TARGETS, DOCUMENT_FIELDS, document_entity, insert_ignoring_duplicates
+
+REBUILD_BATCH_SIZE = 500
+
+# document key -> favorites model, in document order
+DOCUMENT_KINDS = {'people': FavoritePeople, 'starships': FavoriteStarships, 'planets': FavoritePlanets}
+
+
+def _encode(document):
+    return json.dumps(document, separators=(',', ':'))
+
+
+def _build(connection, user_ids):
+    """Documents of `user_ids` read from the favorites tables: one query per kind for all of them."""
+    documents = {user_id: {kind: [] for kind in DOCUMENT_KINDS} for user_id in user_ids}
+    for kind, favorite in DOCUMENT_KINDS.items():
+        column, model = FAVORITE_TARGETS[favorite]
+        stmt = (select(favorite.user_id, *(model.__table__.c[field] for field in DOCUMENT_FIELDS[model]))
+                .join(model, getattr(favorite, column) == model.id)
+                .where(favorite.user_id.in_(user_ids))
+                .order_by(favorite.user_id, favorite.id))
+        for row in connection.execute(stmt):
+            documents[row.user_id][kind].append(document_entity(model, row))
+    return documents
+
+
+def rebuild(user_ids):
+    """
+    Builds and stores the documents of the existing users among `user_ids`, on the primary, and
+    returns them ({user_id: JSON text}). A document whose generation moved while it was being
+    built (a favorites write committed meanwhile) is returned but not stored.
+    """
+    with db.engine.begin() as connection:
+        existing = select(User.id).where(User.id.in_(user_ids))
+        connection.execute(insert_ignoring_duplicates(connection, FavoritesDocument).from_select(['user_id'], existing))
+        generations = dict(connection.execute(
+            select(FavoritesDocument.user_id, FavoritesDocument.generation)
+            .where(FavoritesDocument.user_id.in_(existing))).all())
+        documents = {user_id: _encode(document) for user_id, document in _build(connection, list(generations)).items()}
+        if documents:
+            # One executemany for the whole batch
+            connection.execute(
+                update(FavoritesDocument)
+                .where(FavoritesDocument.user_id == bindparam('b_user_id'),
+                       FavoritesDocument.generation == bindparam('b_generation'))
+                .values(document=bindparam('b_document')),
+                [{'b_user_id': user_id, 'b_generation': generations[user_id], 'b_document': document}
+                 for user_id, document in documents.items()])
+    return documents
+
+
+def patch_document(connection, user_id, kind, added=(), removed=()):
+    """
+    Applies a favorites write of one kind to the user's document, in the caller's transaction.
+    A cleared document stays cleared; its generation still moves.
+    """
+    if not added and not removed:
+        return
+    connection.execute(insert_ignoring_duplicates(connection, FavoritesDocument).values(user_id=user_id))
+    document = connection.execute(
+        select(FavoritesDocument.document).where(FavoritesDocument.user_id == user_id).with_for_update()).scalar()
+    values = {'generation': FavoritesDocument.generation + 1}
+    if document is not None:
+        document = json.loads(document)
+        removed = set(removed)
+        entities = [entity for entity in document[kind] if entity['id'] not in removed]
+        if added:
+            model = FAVORITE_TARGETS[DOCUMENT_KINDS[kind]][1]
+            # New favorites have the highest favorites ids, so they go last, in the order they were inserted
+            stmt = (select(*(model.__table__.c[field] for field in DOCUMENT_FIELDS[model]))
+                    .where(model.id.in_(added)).order_by(model.id))
+            entities += [document_entity(model, row) for row in connection.execute(stmt)]
+        document[kind] = entities
+        values['document'] = _encode(document)
+    connection.execute(update(FavoritesDocument).where(FavoritesDocument.user_id == user_id).values(**values))
+
+
+def _cleared(user):
+    return user.favorites_document is None or user.favorites_document.document is None
+
+
+def rebuild_cleared(users):
+    """
+    Rebuilds the cleared documents among the loaded `users` (with their favorites_document) in
+    one batch, for user_favorites() to find instead of rebuilding them one user at a time.
+    """
+    cleared = [user.id for user in users if _cleared(user)]
+    if cleared:
+        g.setdefault('rebuilt_documents', {}).update(rebuild(cleared))
+
+
+def user_favorites(user):
+    """Favorites of a loaded User (with its favorites_document), rebuilding a cleared document."""
+    if not _cleared(user):
+        return user.favorites_document.favorites()
+    document = g.get('rebuilt_documents', {}).get(user.id)
+    return json.loads(document if document is not None else rebuild([user.id])[user.id])
+
+
+def favorites_response(user_id):
+    document = db.session.execute(
+        select(FavoritesDocument.document).where(FavoritesDocument.user_id == user_id)).scalar()
+    if document is None:
+        document = rebuild([user_id]).get(user_id)
+        if document is None:
+            return jsonify({"msg": "Usuario no existe"}), 404
+    return Response(document, mimetype='application/json'), 200
+
+
+def setup_favorite_documents(app):
+    @app.cli.group('favorites')
+    def favorites_cli():
+        """Materialized favorites documents."""
+
+    @favorites_cli.command('rebuild')
+    @click.option('--user', 'user_ids', type=int, multiple=True, help='Only this user (repeatable).')
+    @click.option('--missing', is_flag=True, help='Only the documents that are cleared or were never built.')
+    def rebuild_command(user_ids, missing):
+        """Rebuilds the favorites documents from the favorites tables."""
+        if user_ids:
+            click.echo(f'{len(rebuild(list(user_ids)))} documents rebuilt')
+            return
+        stmt = select(User.id)
+        if missing:
+            stmt = (stmt.outerjoin(FavoritesDocument, FavoritesDocument.user_id == User.id)
+                    .where(FavoritesDocument.document.is_(None)))
+        total, after = 0, 0
+        while True:
+            with db.engine.connect() as connection:
+                batch = connection.execute(stmt.where(User.id > after)
+                                           .order_by(User.id).limit(REBUILD_BATCH_SIZE)).scalars().all()
+            if not batch:
+                break
+            total += len(rebuild(batch))
+            after = batch[-1]
+        click.echo(f'{total} documents rebuilt')
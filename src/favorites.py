@@ -0,0 +1,147 @@
+"""
+Idempotent, batched writes to the favorites tables (FavoritePeople, FavoriteStarships, FavoritePlanets).
+Every write adjusts the favorite_count of the entities it actually added or removed, and patches
+the user's favorites document, in the same transaction.
+"""
+from collections import Counter
+from flask import request, jsonify
+from sqlalchemy import select, delete
+from utils import APIException
+from cache import catalog_cache
+from changes import publish
+from leaderboard import leaderboards
+from favorite_documents import patch_document
+from models import db, User, People, Planet, Starship, FavoritePeople, FavoriteStarships, FavoritePlanets, \
+    adjust_favorite_counts, insert_ignoring_duplicates
+
+FAVORITES_CHUNK_SIZE = 500
+
+# kind -> (favorites model, column holding the favorited entity id, favorited model)
+FAVORITE_KINDS = {
+    'people': (FavoritePeople, 'people_id', People),
+    'starships': (FavoriteStarships, 'starship_id', Starship),
+    'planets': (FavoritePlanets, 'planet_id', Planet)
+}
+
+
+def existing_ids(entity_model, ids):
+    """The subset of `ids` that exist in the entity table, in one IN query."""
+    if not ids:
+        return set()
+    return set(db.session.execute(select(entity_model.id).where(entity_model.id.in_(ids))).scalars())
+
+
+def _favorited_ids(model, column, user_id, ids):
+    """The subset of `ids` the user already favorited, locking those rows until the transaction ends."""
+    entity_column = getattr(model, column)
+    return set(db.session.execute(
+        select(entity_column).where(model.user_id == user_id, entity_column.in_(ids)).with_for_update()).scalars())
+
+
+def add_favorites(user_id, kind, ids):
+    """Upserts favorites of one kind and returns how many of them were new. Does not commit."""
+    model, column, entity_model = FAVORITE_KINDS[kind]
+    ids = sorted(set(ids))
+    connection = db.session.connection()
+    returning = connection.dialect.insert_returning
+    added = []
+    for start in range(0, len(ids), FAVORITES_CHUNK_SIZE):
+        chunk = ids[start:start + FAVORITES_CHUNK_SIZE]
+        stmt = insert_ignoring_duplicates(connection, model).values([{'user_id': user_id, column: entity_id} for entity_id in chunk])
+        if returning:
+            # RETURNING only yields the rows the conflict clause did not skip
+            added += db.session.execute(stmt.returning(getattr(model, column))).scalars().all()
+        else:
+            existing = _favorited_ids(model, column, user_id, chunk)
+            db.session.execute(stmt)
+            added += [entity_id for entity_id in chunk if entity_id not in existing]
+    adjust_favorite_counts(connection, entity_model, added, 1)
+    _count_change(entity_model, added, 1)
+    patch_document(connection, user_id, kind, added=added)
+    if added:
+        publish(connection, 'favorites', 'added', user_id=user_id, kind=kind, ids=sorted(added))
+    return len(added)
+
+
+def remove_favorites(user_id, kind, ids):
+    """Deletes favorites of one kind and returns how many existed. Does not commit."""
+    model, column, entity_model = FAVORITE_KINDS[kind]
+    if not ids:
+        return 0
+    ids = set(ids)
+    stmt = delete(model).where(model.user_id == user_id, getattr(model, column).in_(ids))
+    if db.session.connection().dialect.delete_returning:
+        removed = db.session.execute(stmt.returning(getattr(model, column))).scalars().all()
+    else:
+        removed = list(_favorited_ids(model, column, user_id, ids))
+        db.session.execute(stmt)
+    adjust_favorite_counts(db.session.connection(), entity_model, removed, -1)
+    _count_change(entity_model, removed, -1)
+    patch_document(db.session.connection(), user_id, kind, removed=removed)
+    if removed:
+        publish(db.session.connection(), 'favorites', 'removed', user_id=user_id, kind=kind, ids=sorted(removed))
+    return len(removed)
+
+
+def _count_change(entity_model, ids, delta):
+    """Notes a favorite_count change of the session's transaction, for the leaderboards."""
+    if ids:
+        db.session.info.setdefault('favorite_counts', {}).setdefault(entity_model, []).append((ids, delta))
+
+
+def commit_favorites(*kinds):
+    """
+    Commits favorites writes, drops the cached entities whose favorite_count changed and
+    updates the leaderboards with the changes.
+    """
+    updates = []
+    for model, changes in db.session.info.pop('favorite_counts', {}).items():
+        deltas = Counter()
+        for ids, delta in changes:
+            for entity_id in ids:
+                deltas[entity_id] += delta
+        # adjust_favorite_counts bumped the table version once per change
+        updates.append((leaderboards[model], leaderboards[model].prepare(deltas, len(changes))))
+    db.session.commit()
+    for kind in kinds:
+        catalog_cache.invalidate(FAVORITE_KINDS[kind][2].__tablename__)
+    for leaderboard, update in updates:
+        if update is not None:
+            leaderboard.apply(update)
+
+
+def _parse_operation(body, operation):
+    requested = body.get(operation) or {}
+    if not isinstance(requested, dict):
+        raise APIException(f"'{operation}' debe ser un objeto con las claves {', '.join(FAVORITE_KINDS)}", status_code=400)
+    for kind, ids in requested.items():
+        if kind not in FAVORITE_KINDS:
+            raise APIException(f"Tipo de favorito desconocido: '{kind}'", status_code=400)
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise APIException(f"'{operation}.{kind}' debe ser una lista de ids", status_code=400)
+    return requested
+
+
+def bulk_favorites(user_id):
+    """
+    Adds and removes many favorites of every kind for a user in a single transaction.
+    Body: {"add": {"people": [1, 2], "planets": [3]}, "remove": {"starships": [4]}}
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"msg": "Debe enviar información"}), 400
+    if db.session.get(User, user_id) is None:
+        return jsonify({"msg": "Usuario no existe"}), 404
+    to_add = _parse_operation(body, 'add')
+    to_remove = _parse_operation(body, 'remove')
+
+    added, removed, missing = {}, {}, {}
+    for kind, ids in to_add.items():
+        found = existing_ids(FAVORITE_KINDS[kind][2], set(ids))
+        missing[kind] = sorted(set(ids) - found)
+        added[kind] = add_favorites(user_id, kind, found)
+    for kind, ids in to_remove.items():
+        removed[kind] = remove_favorites(user_id, kind, ids)
+    commit_favorites(*to_add, *to_remove)
+
+    return jsonify({"added": added, "removed": removed, "missing": missing}), 200
@@ -0,0 +1,96 @@
+"""
+Declarative filtering and sorting of the catalog list endpoints from the query string:
+
+    /planets?climate=arid&population[gt]=1000000&sort=-size,name
+    /starships?speed[gte]=1000&name[prefix]=X&sort=cost_in_credits
+
+Every condition is compiled to SQL WHERE / ORDER BY clauses on the model columns.
+"""
+import enum
+import re
+from flask import request
+from sqlalchemy import Integer, Enum, String
+from utils import APIException
+
+# Query-string parameters that belong to pagination / streaming, not to filtering
+RESERVED_ARGS = {'limit', 'after', 'stream', 'sort', 'fields', 'ids'}
+NON_FILTERABLE = {'version'}
+OPERATORS = {
+    'eq': lambda column, value: column == value,
+    'ne': lambda column, value: column != value,
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'in': lambda column, value: column.in_(value),
+    'prefix': lambda column, value: column.startswith(value, autoescape=True),
+}
+_FILTER = re.compile(r'^(\w+)(?:\[(\w+)\])?$')
+
+
+def coerce(column, value):
+    """Converts a query-string (or cursor) value to the Python type of `column`."""
+    if isinstance(column.type, Enum) and column.type.enum_class is not None:
+        if isinstance(value, enum.Enum):
+            return value
+        try:
+            return column.type.enum_class(value)
+        except ValueError:
+            raise APIException(f"Valor inválido para '{column.key}': {value}", status_code=400)
+    if isinstance(column.type, Integer):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise APIException(f"'{column.key}' debe ser un número entero", status_code=400)
+    return str(value)
+
+
+def _columns(model):
+    return {column.key: column for column in model.__table__.columns if column.key not in NON_FILTERABLE}
+
+
+def parse_filters(model):
+    columns = _columns(model)
+    where = []
+    for name, raw in request.args.items(multi=True):
+        if name in RESERVED_ARGS:
+            continue
+        match = _FILTER.match(name)
+        field, operator = (match.group(1), match.group(2) or 'eq') if match else (name, None)
+        if field not in columns:
+            raise APIException(f"Filtro desconocido: '{field}'", status_code=400)
+        if operator not in OPERATORS:
+            raise APIException(f"Operador desconocido: '{operator}'", status_code=400)
+        column = columns[field]
+        if operator == 'in':
+            value = [coerce(column, item) for item in raw.split(',')]
+        elif operator == 'prefix':
+            # LIKE only applies to text; enums are stored by name, not by the value clients send
+            if not isinstance(column.type, String) or isinstance(column.type, Enum):
+                raise APIException(f"El operador 'prefix' solo se aplica a campos de texto, no a '{field}'",
+                                   status_code=400)
+            value = raw
+        else:
+            value = coerce(column, raw)
+        where.append(OPERATORS[operator](column, value))
+    return where
+
+
+def parse_sort(model):
+    """`sort=-size,name` -> [(size column, descending), (name column, ascending)]"""
+    sort = request.args.get('sort')
+    if not sort:
+        return []
+    columns = _columns(model)
+    order = []
+    for field in sort.split(','):
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        if field not in columns:
+            raise APIException(f"No se puede ordenar por '{field}'", status_code=400)
+        order.append((columns[field], descending))
+    return order
+
+
+def parse_query(model):
+    return parse_filters(model), parse_sort(model)
@@ -0,0 +1,106 @@
+"""
+"Most favorited" leaderboards of the catalog (People, Planet, Starship).
+
+Each worker keeps the top LEADERBOARD_SIZE entities of every table in memory, tagged with the
+table version it reflects, so reads slice a ready list and a restarted worker starts from the
+same counts. Favorites written through this worker update it in place (favorites.commit_favorites):
+the favorite_count changes are applied to the entries, and only the rows entering the board are
+read, in the writing transaction. Any other version change (writes of other workers, new rows,
+an update that could let a row off the board overtake the last entry) reloads it from the
+persisted favorite_count column, an index scan of LEADERBOARD_SIZE rows.
+"""
+import os
+from threading import Lock
+from flask import jsonify
+from sqlalchemy import select
+from pagination import int_arg
+from conditional import catalog_version
+from serializers import PUBLIC_FIELDS, row_serializer
+from models import db, People, Planet, Starship, TableVersion
+
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 100))
+DEFAULT_LIMIT = 10
+
+
+def _rank(entry):
+    return -entry['favorite_count'], entry['id']
+
+
+class Leaderboard:
+    def __init__(self, model):
+        self.model = model
+        self._lock = Lock()
+        self._entries = []
+        self._version = None
+
+    def top(self, limit):
+        version = catalog_version(self.model)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._entries = self._load()
+                    self._version = version
+        return self._entries[:limit]
+
+    def _select(self):
+        model = self.model
+        return select(*(model.__table__.c[field] for field in PUBLIC_FIELDS[model]))
+
+    def _load(self):
+        model = self.model
+        stmt = (self._select()
+                .where(model.favorite_count > 0)
+                .order_by(model.favorite_count.desc(), model.id)
+                .limit(LEADERBOARD_SIZE))
+        serialize = row_serializer(model, PUBLIC_FIELDS[model])
+        return [serialize(row) for row in db.session.execute(stmt)]
+
+    def prepare(self, deltas, bumps):
+        """
+        Reads, in the transaction that changed favorite_count by `deltas` ({id: change}) and bumped
+        the table version `bumps` times, what apply() needs once it commits; None when the board
+        does not reflect the version right before the transaction and will reload anyway.
+        """
+        model = self.model
+        board_version, entries = self._version, self._entries
+        if board_version is None:
+            return None
+        version = db.session.scalar(select(TableVersion.version).where(TableVersion.table_name == model.__tablename__))
+        if board_version != version - bumps:
+            return None
+        ranked = {entry['id'] for entry in entries}
+        entering = [entity_id for entity_id, delta in deltas.items() if delta > 0 and entity_id not in ranked]
+        rows = {}
+        if entering:
+            serialize = row_serializer(model, PUBLIC_FIELDS[model])
+            rows = {row.id: serialize(row) for row in db.session.execute(self._select().where(model.id.in_(entering)))}
+        return board_version, version, deltas, rows
+
+    def apply(self, update):
+        """Applies a committed prepare() result, unless the board would no longer be exact."""
+        board_version, version, deltas, rows = update
+        with self._lock:
+            if self._version != board_version:
+                return
+            full = len(self._entries) >= LEADERBOARD_SIZE
+            ranked = {entry['id']: dict(entry) for entry in self._entries}
+            for entity_id, delta in deltas.items():
+                if entity_id in ranked:
+                    ranked[entity_id]['favorite_count'] += delta
+            # Rows entering were read after the write: their counts already include it
+            ranked.update(rows)
+            board = sorted((entry for entry in ranked.values() if entry['favorite_count'] > 0), key=_rank)
+            if full and (len(board) < LEADERBOARD_SIZE or
+                         _rank(board[LEADERBOARD_SIZE - 1]) > _rank(self._entries[-1])):
+                # A row off the board may now rank above the last entry: leave it to the reload
+                return
+            self._entries = board[:LEADERBOARD_SIZE]
+            self._version = version
+
+
+leaderboards = {model: Leaderboard(model) for model in (People, Planet, Starship)}
+
+
+def top_favorited(model):
+    limit = min(int_arg('limit', DEFAULT_LIMIT, minimum=1), LEADERBOARD_SIZE)
+    return jsonify(leaderboards[model].top(limit)), 200
@@ -0,0 +1,156 @@
+"""
+Request-level performance instrumentation: per-route latency, SQL query counts/durations and
+response sizes, exposed at /metrics in the Prometheus text format and optionally as a
+`Server-Timing` response header.
+
+METRICS_SAMPLE_RATE (0..1, default 1) is the share of requests measured; with 0 no hook or
+SQLAlchemy listener is installed at all. METRICS_SERVER_TIMING=1 enables the header.
+"""
+import os
+import random
+import time
+from bisect import bisect_left
+from threading import Lock
+from flask import g, request, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms keyed by (metric name, label pairs); one lock guards every update."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text, buckets):
+        self._help[name] = (help_text, buckets)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._help[name][1])
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for name, (help_text, _) in sorted(self._help.items()):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in items:
+                    if metric != name:
+                        continue
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                    prefix = label_text + ',' if label_text else ''
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'Time spent handling a request.', LATENCY_BUCKETS)
+registry.describe('http_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS)
+registry.describe('db_queries_per_request', 'SQL statements executed by a request.', COUNT_BUCKETS)
+registry.describe('db_query_duration_seconds', 'Time spent executing a SQL statement.', LATENCY_BUCKETS)
+
+
+# The start time is kept on the statement's execution context, which is dropped with the
+# statement when it fails, rather than on the pooled connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'metrics_start' in g:
+        context.metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_query_start', None)
+    if start is None or not has_request_context() or 'metrics_start' not in g:
+        return
+    elapsed = time.perf_counter() - start
+    g.metrics_sql_count += 1
+    g.metrics_sql_time += elapsed
+    registry.observe('db_query_duration_seconds', elapsed, route=_route())
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def sample_rate():
+    return float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+
+
+def sampled(rate):
+    """Whether to measure a request, at a sample rate > 0."""
+    return rate >= 1 or random.random() < rate
+
+
+def observe_request(method, route, status, elapsed, query_count, size=None):
+    """Records a measured request; `size` is None for streamed bodies."""
+    registry.observe('http_request_duration_seconds', elapsed, method=method, route=route, status=status)
+    registry.observe('db_queries_per_request', query_count, route=route)
+    if size is not None:
+        registry.observe('http_response_size_bytes', size, route=route)
+
+
+def setup_metrics(app):
+    rate = sample_rate()
+    server_timing = os.environ.get('METRICS_SERVER_TIMING') == '1'
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if rate <= 0:
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        if sampled(rate):
+            g.metrics_start = time.perf_counter()
+            g.metrics_sql_count = 0
+            g.metrics_sql_time = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        observe_request(request.method, _route(), response.status_code, elapsed, g.metrics_sql_count,
+                        None if response.is_streamed else response.calculate_content_length() or 0)
+        if server_timing:
+            response.headers['Server-Timing'] = (
+                f'db;dur={g.metrics_sql_time * 1000:.2f};desc="{g.metrics_sql_count} queries", '
+                f'app;dur={(elapsed - g.metrics_sql_time) * 1000:.2f}, total;dur={elapsed * 1000:.2f}')
+        return response
@@ -1,10 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, ForeignKey, Integer
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Boolean, ForeignKey, Integer, DateTime, Text, select, update, insert, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Mapped, mapped_column, relationship, Session
+from collections import Counter
 from typing import List
+from datetime import datetime, timezone
 import enum
+import json
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -18,17 +23,21 @@ class User(db.Model):
     favorite_people: Mapped[list['FavoritePeople']] = relationship(back_populates='user')
     favorite_starships: Mapped[list['FavoriteStarships']] = relationship(back_populates='user')
     favorite_planets: Mapped[list['FavoritePlanets']] = relationship(back_populates='user')
+    favorites_document: Mapped['FavoritesDocument'] = relationship(cascade='all, delete-orphan', passive_deletes=True)
     
     def serialize(self):     
+        # A cleared document is rebuilt with one query per kind, not one per favorite
+        from favorite_documents import user_favorites
+        favorites = user_favorites(self)
         return {
             "id": self.id,
             "email": self.email,
             "password": self.password,
             "username": self.username,
             "name": self.name,
-            "favorite_people": [fav.people.serialize() for fav in self.favorite_people],
-            "favorite_starships": [fav.starship.serialize() for fav in self.favorite_starships],
-            "favorite_planets": [fav.planet.serialize() for fav in self.favorite_planets] 
+            "favorite_people": favorites["people"],
+            "favorite_starships": favorites["starships"],
+            "favorite_planets": favorites["planets"]
         }    
 
 class GenderEnum(enum.Enum):
@@ -38,46 +47,79 @@ class GenderEnum(enum.Enum):
 
 class People(db.Model):
     __tablename__ = 'people'
+    # (column, id) indexes serve filtering and keyset pagination sorted by that column
+    __table_args__ = (
+        db.Index('ix_people_gender_id', 'gender', 'id'),
+        db.Index('ix_people_height_id', 'height', 'id'),
+        db.Index('ix_people_favorite_count_id', db.text('favorite_count DESC'), 'id'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(30), nullable=False)
+    name: Mapped[str] = mapped_column(String(30), nullable=False, index=True)
     gender: Mapped[GenderEnum] = mapped_column(db.Enum(GenderEnum), nullable= False)
     height: Mapped[int] = mapped_column(Integer, nullable=False)
     favorite_by: Mapped[List['FavoritePeople']] = relationship(back_populates='people')
+    # Number of favorites rows pointing at the entity, kept up to date with every favorite write
+    favorite_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def serializable(self):
         return {
             "id": self.id,
             "name": self.name,
-            "gender": self.gender,
-            "height": self.height
+            "gender": self.gender.value,
+            "height": self.height,
+            "favorite_count": self.favorite_count
         }
 
 
 class Starship(db.Model):
     __tablename__ = 'starship'
+    # (column, id) indexes serve filtering and keyset pagination sorted by that column
+    __table_args__ = (
+        db.Index('ix_starship_cost_in_credits_id', 'cost_in_credits', 'id'),
+        db.Index('ix_starship_speed_id', 'speed', 'id'),
+        db.Index('ix_starship_favorite_count_id', db.text('favorite_count DESC'), 'id'),
+    )
     id: Mapped[int] = mapped_column(primary_key = True)
-    name: Mapped[str] = mapped_column(String(50), nullable= False)
+    name: Mapped[str] = mapped_column(String(50), nullable= False, index=True)
     cost_in_credits: Mapped[int] = mapped_column(Integer, nullable= False)
     speed: Mapped[int] = mapped_column(Integer, nullable= False)
     favorite_by: Mapped[list['FavoriteStarships']] = relationship(back_populates='starship')   
+    # Number of favorites rows pointing at the entity, kept up to date with every favorite write
+    favorite_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def serializable(self):
         return {
             "id": self.id,
             "name": self.name,
             "cost_in_credits": self.cost_in_credits,
-            "speed": self.speed
+            "speed": self.speed,
+            "favorite_count": self.favorite_count
         }
 
 
 class Planet(db.Model):
     __tablename__ = 'planet'
+    # (column, id) indexes serve filtering and keyset pagination sorted by that column
+    __table_args__ = (
+        db.Index('ix_planet_climate_id', 'climate', 'id'),
+        db.Index('ix_planet_population_id', 'population', 'id'),
+        db.Index('ix_planet_size_id', 'size', 'id'),
+        db.Index('ix_planet_favorite_count_id', db.text('favorite_count DESC'), 'id'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(50),nullable=False)
+    name: Mapped[str] = mapped_column(String(50),nullable=False, index=True)
     size: Mapped[int] = mapped_column(Integer,nullable=False)
     population: Mapped[int] = mapped_column(Integer,nullable=False)
     climate: Mapped[str] = mapped_column(String(100), nullable= False)
     favorite_by: Mapped[List['FavoritePlanets']] = relationship(back_populates='planet')
+    # Number of favorites rows pointing at the entity, kept up to date with every favorite write
+    favorite_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def serializable(self):
         return {
@@ -85,29 +127,225 @@ class Planet(db.Model):
             "name": self.name,
             "size": self.size,
             "population": self.population,
-            "climate": self.climate
+            "climate": self.climate,
+            "favorite_count": self.favorite_count
         }
 
 class FavoritePeople(db.Model):
     __tablename__ = 'favorite_people'
+    __table_args__ = (db.Index('uq_favorite_people_user_id_people_id', 'user_id', 'people_id', unique=True),)
     id: Mapped[int] = mapped_column(primary_key = True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'))
     user: Mapped['User'] = relationship(back_populates='favorite_people')   
-    people_id: Mapped[int] = mapped_column(ForeignKey('people.id'))
+    people_id: Mapped[int] = mapped_column(ForeignKey('people.id'), index=True)
     people: Mapped['People'] = relationship(back_populates='favorite_by')   
 
 class FavoriteStarships(db.Model):
     __tablename__ = 'favorite_starships'
+    __table_args__ = (db.Index('uq_favorite_starships_user_id_starship_id', 'user_id', 'starship_id', unique=True),)
     id: Mapped[int] = mapped_column(primary_key = True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'))
     user: Mapped['User'] = relationship(back_populates = 'favorite_starships')
-    starship_id: Mapped[int] = mapped_column(ForeignKey('starship.id'))
+    starship_id: Mapped[int] = mapped_column(ForeignKey('starship.id'), index=True)
     starship: Mapped['Starship'] = relationship(back_populates='favorite_by')
 
 class FavoritePlanets(db.Model):
     __tablename__ = 'favorite_planets'
+    __table_args__ = (db.Index('uq_favorite_planets_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
     id: Mapped[int] = mapped_column(primary_key = True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'))
     user: Mapped['User'] = relationship(back_populates='favorite_planets') 
-    planet_id: Mapped[int] = mapped_column(ForeignKey('planet.id'))
+    planet_id: Mapped[int] = mapped_column(ForeignKey('planet.id'), index=True)
     planet: Mapped['Planet'] = relationship(back_populates= 'favorite_by')
+
+
+class FavoritesDocument(db.Model):
+    # The user's favorites ({"people": [...], "starships": [...], "planets": [...]}) serialized
+    # once and patched by every favorite write; document is NULL until the next read rebuilds it.
+    # generation moves with every write, so a rebuild that raced a write is not stored.
+    __tablename__ = 'user_favorites_document'
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    document: Mapped[str] = mapped_column(Text, nullable=True)
+    generation: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+
+    def favorites(self):
+        return json.loads(self.document) if self.document is not None else None
+
+
+class TableVersion(db.Model):
+    # One row per catalog table, bumped in the same transaction as every write to it,
+    # so collection ETags can be computed without reading the table itself.
+    # snapshot_id is the content id of the catalog snapshot the table holds (snapshot.py), set by
+    # an export or a complete import and cleared by the next write
+    __tablename__ = 'table_version'
+    table_name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    snapshot_id: Mapped[str] = mapped_column(String(64), nullable=True)
+
+
+class ChangeLog(db.Model):
+    # Append-only log of the API writes, read by the /changes feed. The id is the event id
+    # clients resume from (AUTOINCREMENT keeps SQLite from reusing the ids of pruned rows)
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id: Mapped[int] = mapped_column(primary_key=True)
+    type: Mapped[str] = mapped_column(String(20), nullable=False)
+    # The event as JSON, without its id
+    data: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+VERSIONED_TABLES = {People.__tablename__, Starship.__tablename__, Planet.__tablename__}
+
+
+def bump_table_version(connection, table_name, snapshot_id=None):
+    now = datetime.now(timezone.utc)
+    result = connection.execute(
+        update(TableVersion)
+        .where(TableVersion.table_name == table_name)
+        .values(version=TableVersion.version + 1, updated_at=now, snapshot_id=snapshot_id))
+    if result.rowcount == 0:
+        connection.execute(insert(TableVersion).values(table_name=table_name, version=1, updated_at=now,
+                                                       snapshot_id=snapshot_id))
+
+
+def names_version(table_name):
+    """
+    table_version row of the names of a catalog table, moved only by inserts, deletes and
+    renames: the search index is keyed on it, so favorites (which move the table version
+    through favorite_count) do not rebuild it.
+    """
+    return f'{table_name}:names'
+
+
+def get_table_version(table_name):
+    row = db.session.execute(
+        select(TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.table_name == table_name)).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
+
+
+# favorites model -> (column holding the favorited entity id, favorited model)
+FAVORITE_TARGETS = {
+    FavoritePeople: ('people_id', People),
+    FavoriteStarships: ('starship_id', Starship),
+    FavoritePlanets: ('planet_id', Planet),
+}
+
+
+# Fields of the favorited entities kept in the favorites documents. favorite_count is left out:
+# it moves with every other user's favorites, and keeping it would rewrite every fan's document.
+DOCUMENT_FIELDS = {
+    People: ('id', 'name', 'gender', 'height'),
+    Starship: ('id', 'name', 'cost_in_credits', 'speed'),
+    Planet: ('id', 'name', 'size', 'population', 'climate'),
+}
+
+
+def document_entity(model, entity):
+    """The favorites document form of an entity (ORM object or row with DOCUMENT_FIELDS attributes)."""
+    values = {field: getattr(entity, field) for field in DOCUMENT_FIELDS[model]}
+    return {field: value.value if isinstance(value, enum.Enum) else value for field, value in values.items()}
+
+
+def insert_ignoring_duplicates(connection, model):
+    """INSERT that silently skips rows violating a primary key or unique index."""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model).prefix_with('IGNORE')
+
+
+def invalidate_favorites_documents(connection, user_ids):
+    """
+    Clears the favorites documents of `user_ids` (ids, or a SELECT of them) in the caller's
+    transaction. Missing rows are created, so a rebuild running concurrently always finds the
+    generation moved and does not store what it read before this write.
+    """
+    if isinstance(user_ids, (list, set, tuple)):
+        user_ids = select(User.id).where(User.id.in_(user_ids))
+    connection.execute(insert_ignoring_duplicates(connection, FavoritesDocument).from_select(['user_id'], user_ids))
+    connection.execute(
+        update(FavoritesDocument)
+        .where(FavoritesDocument.user_id.in_(user_ids))
+        .values(document=None, generation=FavoritesDocument.generation + 1))
+
+
+def adjust_favorite_counts(connection, model, ids, delta):
+    """
+    Adds `delta` to favorite_count once per occurrence of an id in `ids`, bumping the row and
+    table versions like any other write to the entity. Runs in the caller's transaction.
+    """
+    by_amount = {}
+    for entity_id, occurrences in Counter(ids).items():
+        by_amount.setdefault(occurrences * delta, []).append(entity_id)
+    for amount, entity_ids in by_amount.items():
+        connection.execute(
+            update(model)
+            .where(model.id.in_(entity_ids))
+            .values(favorite_count=model.favorite_count + amount, version=model.version + 1))
+    if by_amount:
+        bump_table_version(connection, model.__tablename__)
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_favorites_after_flush(session, flush_context):
+    # Favorites written through the ORM (the admin UI); the API routes write them with Core
+    # statements in favorites.py, which adjust the counts themselves
+    changes = {}
+    for obj, delta in [*((obj, 1) for obj in session.new), *((obj, -1) for obj in session.deleted)]:
+        if type(obj) in FAVORITE_TARGETS:
+            column, model = FAVORITE_TARGETS[type(obj)]
+            changes.setdefault((model, delta), []).append(getattr(obj, column))
+    for obj in session.dirty:
+        if type(obj) in FAVORITE_TARGETS:
+            column, model = FAVORITE_TARGETS[type(obj)]
+            history = db.inspect(obj).attrs[column].history
+            changes.setdefault((model, 1), []).extend(history.added)
+            changes.setdefault((model, -1), []).extend(history.deleted)
+    for (model, delta), ids in changes.items():
+        adjust_favorite_counts(session.connection(), model, [i for i in ids if i is not None], delta)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_documents_after_flush(session, flush_context):
+    # Favorites written through the ORM clear their user's document, and edited or deleted
+    # entities clear the documents of every user who favorited them (their favorite_by rows)
+    user_ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if type(obj) in FAVORITE_TARGETS:
+            user_ids.update(db.inspect(obj).attrs['user_id'].history.deleted, [obj.user_id])
+    user_ids.discard(None)
+    if user_ids:
+        invalidate_favorites_documents(session.connection(), user_ids)
+
+    edited = {}
+    for obj in (*session.dirty, *session.deleted):
+        model = type(obj)
+        if model in DOCUMENT_FIELDS and (obj in session.deleted or any(
+                db.inspect(obj).attrs[field].history.has_changes() for field in DOCUMENT_FIELDS[model])):
+            edited.setdefault(model, []).append(obj.id)
+    for model, ids in edited.items():
+        favorites = model.favorite_by.property.mapper.class_
+        column = getattr(favorites, FAVORITE_TARGETS[favorites][0])
+        invalidate_favorites_documents(session.connection(), select(favorites.user_id).where(column.in_(ids)).distinct())
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_versions_after_flush(session, flush_context):
+    dirty = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    catalog = [obj for obj in (*session.new, *dirty, *session.deleted)
+               if getattr(obj, '__tablename__', None) in VERSIONED_TABLES]
+    for table_name in sorted({obj.__tablename__ for obj in catalog}):
+        bump_table_version(session.connection(), table_name)
+    # Edits of other columns leave the names (and the search index) as they were
+    renamed = {obj.__tablename__ for obj in catalog
+               if obj not in dirty or db.inspect(obj).attrs['name'].history.has_changes()}
+    for table_name in sorted(renamed):
+        bump_table_version(session.connection(), names_version(table_name))
+
@@ -0,0 +1,205 @@
+"""
+Keyset (cursor) pagination and streaming helpers for the list endpoints
+"""
+import base64
+import enum
+import json
+from flask import request, url_for, Response, stream_with_context
+from sqlalchemy import select, and_, or_
+from utils import APIException
+from filters import coerce
+from serializers import dumps, row_columns, row_serializer
+from compression import Payload
+from snapshot import served_table
+from conditional import catalog_version
+from replicas import read_bind
+from models import db
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def int_arg(name, default=None, minimum=0):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException(f"El parámetro '{name}' debe ser un número entero", status_code=400)
+    if value < minimum:
+        raise APIException(f"El parámetro '{name}' debe ser mayor o igual a {minimum}", status_code=400)
+    return value
+
+
+def get_page_args():
+    limit = min(int_arg('limit', DEFAULT_LIMIT, minimum=1), MAX_LIMIT)
+    return limit, request.args.get('after') or None
+
+
+def ordering(model, order=()):
+    """The requested order plus the id as tie-breaker, so every row has a unique position."""
+    order = list(order)
+    if not any(column.key == 'id' for column, _ in order):
+        order.append((model.id, False))
+    return order
+
+
+def encode_cursor(row, order):
+    if len(order) == 1:
+        return str(row.id)
+    values = [getattr(row, column.key) for column, _ in order]
+    values = [value.value if isinstance(value, enum.Enum) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(after, order):
+    try:
+        if len(order) == 1:
+            values = [after]
+        else:
+            values = json.loads(base64.urlsafe_b64decode(after.encode()))
+            if not isinstance(values, list) or len(values) != len(order):
+                raise ValueError
+    except ValueError:
+        raise APIException("El parámetro 'after' no es válido", status_code=400)
+    return [coerce(column, value) for (column, _), value in zip(order, values)]
+
+
+def after_clause(order, values):
+    """Rows strictly after `values` in `order`: (a > x) OR (a = x AND b > y) OR ..."""
+    alternatives = []
+    for i, (column, descending) in enumerate(order):
+        equal = [order[j][0] == values[j] for j in range(i)]
+        beyond = column < values[i] if descending else column > values[i]
+        alternatives.append(and_(*equal, beyond))
+    return or_(*alternatives)
+
+
+def ordered_select(model, options=(), where=(), order=(), columns=None):
+    stmt = select(*columns).select_from(model) if columns else select(model).options(*options)
+    return (stmt.where(*where)
+            .order_by(*(column.desc() if descending else column.asc() for column, descending in order)))
+
+
+def _fetch(stmt, columns):
+    result = db.session.execute(stmt)
+    return result if columns else result.scalars()
+
+
+def keyset_page(model, limit, after, options=(), where=(), order=(), columns=None):
+    """
+    One page of `model` rows after the `after` cursor. With `columns`, rows are plain
+    Core tuples of those columns instead of ORM objects.
+    """
+    order = ordering(model, order)
+    # One row more than requested tells us whether there is a next page
+    stmt = ordered_select(model, options, where, order, columns).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(after_clause(order, decode_cursor(after, order)))
+    rows = _fetch(stmt, columns).all()
+    next_after = encode_cursor(rows[limit - 1], order) if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+def get_stream_format():
+    stream = request.args.get('stream')
+    if stream is None:
+        return None
+    if stream not in STREAM_FORMATS:
+        raise APIException("El parámetro 'stream' debe ser 'json' o 'ndjson'", status_code=400)
+    return stream
+
+
+def next_link(next_after, limit):
+    if next_after is None:
+        return None
+    args = request.args.to_dict(flat=False)
+    args.update(after=next_after, limit=limit)
+    return url_for(request.endpoint, _external=True, **request.view_args, **args)
+
+
+def stream_rows(model, serialize, fmt, options=(), where=(), order=(), columns=None, prepare=None):
+    """Streams every matching row from a server-side cursor, never holding the table in memory."""
+    stmt = (ordered_select(model, options, where, ordering(model, order), columns)
+            .execution_options(yield_per=STREAM_BATCH_SIZE))
+
+    def generate():
+        first = True
+        if fmt == 'json':
+            yield b'['
+        for rows in _fetch(stmt, columns).partitions():
+            if prepare is not None:
+                prepare(rows)
+            for row in rows:
+                item = dumps(serialize(row))
+                if fmt == 'ndjson':
+                    yield item + b'\n'
+                else:
+                    yield item if first else b',' + item
+                first = False
+        if fmt == 'json':
+            yield b']'
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
+
+
+def list_response(model, serialize=None, envelope=None, options=(), cache=None, where=(), order=(), fields=None,
+                  prepare=None):
+    """
+    Builds the response of a list endpoint: a keyset page by default (`limit`, `after`)
+    or every matching row when `stream=json|ndjson` is requested.
+    `where` and `order` are SQL clauses (see filters.parse_query); pages follow `order` with the id as tie-breaker.
+    With `fields` only those columns are selected and rows are serialized straight from Core tuples;
+    otherwise ORM objects are loaded (with `options`) and passed to `serialize`, after `prepare`
+    (when given) has seen the whole page or stream batch, to load what they need in one go.
+    The link to the next page goes in the `Link` header and, for enveloped responses, in `next`.
+    When a `cache` is given, encoded pages are read through it, keyed by the table version of the
+    request's ETag; it cannot be combined with `envelope`,
+    whose body holds the next link.
+    """
+    columns = None
+    if fields is not None:
+        columns = row_columns(model, fields, order)
+        serialize = row_serializer(model, fields)
+
+    fmt = get_stream_format()
+    if fmt is not None:
+        return stream_rows(model, serialize, fmt, options, where, order, columns, prepare)
+
+    limit, after = get_page_args()
+
+    def load():
+        table = served_table(model) if fields is not None and not where and not order else None
+        if table is not None and (after is None or after.isdigit()):
+            return table.page(None if after is None else int(after), limit, fields)
+        rows, next_after = keyset_page(model, limit, after, options, where, order, columns)
+        if prepare is not None:
+            prepare(rows)
+        return [serialize(row) for row in rows], next_after
+
+    if cache is not None:
+        # The page is kept encoded, with its compressed variants; the next link depends on
+        # the request host so only its cursor is cached
+        def load_payload():
+            data, next_after = load()
+            return Payload(dumps(data)), next_after
+        args = tuple(sorted(request.args.items(multi=True)))
+        key = (model.__tablename__, read_bind(), 'page', catalog_version(model), args)
+        payload, next_after = cache.get_or_load(key, load_payload)
+        link = next_link(next_after, limit)
+        response = Response(payload.body, mimetype='application/json')
+        response.payload = payload
+    else:
+        data, next_after = load()
+        link = next_link(next_after, limit)
+        response = Response(dumps({envelope: data, 'next': link} if envelope is not None else data),
+                            mimetype='application/json')
+    if link is not None:
+        response.headers['Link'] = f'<{link}>; rel="next"'
+    return response, 200
@@ -0,0 +1,84 @@
+"""
+Per-request SQL query log with slow-query and N+1 detection, for debugging and profiling.
+
+Enabled for every request with QUERY_DEBUG=1, or per request with the `X-Debug-Queries: 1`
+header when the app runs in debug mode or QUERY_DEBUG_ALLOW_HEADER=1. Each logged request
+gets an `X-Query-Count` header and a structured `query_report` log line flagging statements
+slower than SLOW_QUERY_MS and statements repeated N_PLUS_ONE_THRESHOLD times or more.
+"""
+import json
+import os
+import time
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+
+# Start times live on the statement's execution context, not on the pooled connection, so a
+# failed statement leaves nothing behind (as in metrics.py)
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and g.get('query_log') is not None:
+        context.query_log_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'query_log_start', None)
+    if start is None or not has_request_context() or g.get('query_log') is None:
+        return
+    g.query_log.append((statement, (time.perf_counter() - start) * 1000))
+
+
+def build_report(queries):
+    # Parameterized statements share their text, so repeats of the same text are the N+1 signature
+    repeated = Counter(statement for statement, _ in queries)
+    return {
+        "query_count": len(queries),
+        "total_ms": round(sum(duration for _, duration in queries), 3),
+        "slow": [{"statement": statement, "ms": round(duration, 3)}
+                 for statement, duration in queries if duration >= SLOW_QUERY_MS],
+        "repeated": [{"statement": statement, "count": count}
+                     for statement, count in repeated.most_common() if count >= N_PLUS_ONE_THRESHOLD]
+    }
+
+
+def _modes(app):
+    """(every request is logged, the X-Debug-Queries header is honoured)."""
+    return os.environ.get('QUERY_DEBUG') == '1', app.debug or os.environ.get('QUERY_DEBUG_ALLOW_HEADER') == '1'
+
+
+def logs_request(app, debug_header):
+    """Whether a request sending `debug_header` as X-Debug-Queries gets a query report."""
+    always, allow_header = _modes(app)
+    return always or (allow_header and debug_header == '1')
+
+
+def setup_query_log(app):
+    always, allow_header = _modes(app)
+    if not always and not allow_header:
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_log():
+        if always or request.headers.get('X-Debug-Queries') == '1':
+            g.query_log = []
+
+    @app.after_request
+    def report_queries(response):
+        queries = g.get('query_log')
+        if queries is None:
+            return response
+        report = build_report(queries)
+        response.headers['X-Query-Count'] = str(report['query_count'])
+        response.headers['X-Query-Time'] = f"{report['total_ms']:.3f}"
+        log = app.logger.warning if report['slow'] or report['repeated'] else app.logger.info
+        log(json.dumps({"event": "query_report", "method": request.method, "path": request.full_path,
+                        "status": response.status_code, **report}))
+        return response
@@ -0,0 +1,257 @@
+"""
+Per-client rate limiting with a token bucket per route group.
+
+    RATELIMIT_ENABLED      0 disables every limit (default 1)
+    RATELIMIT_STORAGE_URL  memory:// (per worker process, the default) or sqlite:////path/to/file.db,
+                           a file every worker on the host shares so limits hold across processes
+    RATELIMIT_TRUST_PROXY  1 to identify clients by the first X-Forwarded-For address (default 0)
+    RATELIMIT_API_KEYS     comma separated SHA-256 hex digests of the issued API keys
+                           (`printf %s "$KEY" | sha256sum`)
+    RATE_LIMITS            overrides, e.g. "users=2/s:10;bulk=10/m:5" (group=rate/period:burst)
+
+Clients are identified by their `X-API-Key` header when it is one of RATELIMIT_API_KEYS,
+otherwise by address: an unknown key cannot buy a fresh bucket. Buckets are kept in the
+GCRA form: a single "theoretical arrival time" per (group, client) replaces the token count
+and refill timestamp, so a check is one read-modify-write of one number, done under one of
+LOCK_STRIPES locks in memory or by a single UPSERT in the shared SQLite file.
+
+Responses carry RateLimit-Limit / -Remaining / -Reset / -Policy; refused ones get a 429 with
+Retry-After.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from flask import g, request, jsonify
+
+DEFAULT_LIMITS = {
+    'default': '20/s:40',
+    'list': '10/s:30',
+    'users': '2/s:10',
+    'stream': '6/m:3',
+    'bulk': '10/m:5',
+}
+API_KEY_DIGESTS = frozenset(digest.strip().lower() for digest in os.environ.get('RATELIMIT_API_KEYS', '').split(',')
+                            if digest.strip())
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+LOCK_STRIPES = 64
+MAX_MEMORY_KEYS = 100_000
+
+# endpoint -> route group; every other endpoint is in 'default'
+ROUTE_GROUPS = {
+    'api.get_users': 'users',
+    'api.get_people': 'list',
+    'api.get_planets': 'list',
+    'api.get_starships': 'list',
+    'api.get_top_people': 'list',
+    'api.get_top_planets': 'list',
+    'api.get_top_starships': 'list',
+    'api.search': 'list',
+    'api.get_batch': 'list',
+    'api.get_changes': 'list',
+    'api.add_people_bulk': 'bulk',
+    'api.add_planet_bulk': 'bulk',
+    'api.add_starship_bulk': 'bulk',
+    'api.update_user_favorites': 'bulk',
+}
+# Full-table streams are the most expensive reads and get their own, smaller bucket
+STREAMABLE_GROUPS = {'list', 'users'}
+EXEMPT_ENDPOINTS = {'healthz', 'metrics', 'static'}
+
+
+class Limit:
+    __slots__ = ('rate', 'period', 'burst', 'interval')
+
+    def __init__(self, rate, period, burst):
+        self.rate = rate
+        self.period = period
+        self.burst = burst
+        # Seconds one request "costs"; a full bucket is burst * interval seconds of credit
+        self.interval = period / rate
+
+    @classmethod
+    def parse(cls, text):
+        rate, _, burst = text.partition(':')
+        count, _, unit = rate.partition('/')
+        return cls(int(count), PERIODS[unit.strip()], int(burst or count))
+
+
+def load_limits():
+    limits = {group: Limit.parse(text) for group, text in DEFAULT_LIMITS.items()}
+    for item in os.environ.get('RATE_LIMITS', '').split(';'):
+        if item.strip():
+            group, _, text = item.partition('=')
+            limits[group.strip()] = Limit.parse(text)
+    return limits
+
+
+class MemoryBackend:
+    """Arrival times in a dict; lock striping keeps concurrent clients off each other's locks."""
+
+    def __init__(self):
+        self._tats = {}
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._next_prune = 0.0
+
+    def update(self, key, now, interval, capacity):
+        """Applies one request to the bucket; returns (allowed, theoretical arrival time)."""
+        with self._locks[zlib.crc32(key.encode()) % LOCK_STRIPES]:
+            tat = max(self._tats.get(key, now), now) + interval
+            if tat - capacity > now:
+                return False, tat - interval
+            self._tats[key] = tat
+        if len(self._tats) > MAX_MEMORY_KEYS and now >= self._next_prune:
+            self._prune(now)
+        return True, tat
+
+    def _prune(self, now):
+        # Buckets whose arrival time has passed are full again, the same as absent ones
+        self._next_prune = now + 1
+        for key in [key for key, tat in list(self._tats.items()) if tat <= now]:
+            self._tats.pop(key, None)
+
+
+class SQLiteBackend:
+    """Arrival times in a SQLite file shared by every worker process of the host."""
+
+    UPSERT = (
+        'INSERT INTO ratelimit (key, tat) VALUES (:key, :now + :interval) '
+        'ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval '
+        'WHERE max(tat, :now) + :interval - :capacity <= :now '
+        'RETURNING tat')
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS ratelimit (key TEXT PRIMARY KEY, tat REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=5, check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    def update(self, key, now, interval, capacity):
+        connection = self._connection()
+        # A single statement is atomic, so concurrent workers never lose an update
+        row = connection.execute(self.UPSERT, {'key': key, 'now': now, 'interval': interval,
+                                               'capacity': capacity}).fetchone()
+        self._calls += 1
+        if self._calls % 10_000 == 0:
+            connection.execute('DELETE FROM ratelimit WHERE tat <= ?', (now,))
+        if row is not None:
+            return True, row[0]
+        tat = connection.execute('SELECT tat FROM ratelimit WHERE key = ?', (key,)).fetchone()[0]
+        return False, tat
+
+
+def backend_from_url(url):
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url in ('', 'memory://'):
+        return MemoryBackend()
+    raise ValueError(f'Unsupported RATELIMIT_STORAGE_URL: {url}')
+
+
+class Decision:
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self, allowed, limit, remaining, reset, retry_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit.burst),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(math.ceil(self.reset)),
+            'RateLimit-Policy': f'{self.limit.burst};w={math.ceil(self.limit.burst * self.limit.interval)}',
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(math.ceil(self.retry_after))
+        return headers
+
+
+class RateLimiter:
+    def __init__(self, backend, limits, clock=time.time):
+        self.backend = backend
+        self.limits = limits
+        self.clock = clock
+
+    def hit(self, group, client):
+        limit = self.limits.get(group) or self.limits['default']
+        now = self.clock()
+        capacity = limit.burst * limit.interval
+        allowed, tat = self.backend.update(f'{group}:{client}', now, limit.interval, capacity)
+        remaining = max(0, int((now + capacity - tat) / limit.interval))
+        retry_after = 0 if allowed else tat + limit.interval - capacity - now
+        return Decision(allowed, limit, remaining, max(0.0, tat - now), retry_after)
+
+
+def client_key(api_key, remote_addr, forwarded_for):
+    if api_key:
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        if digest in API_KEY_DIGESTS:
+            return f'key:{digest[:32]}'
+    if forwarded_for and os.environ.get('RATELIMIT_TRUST_PROXY') == '1':
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr or 'unknown'
+
+
+def route_group(endpoint, streaming):
+    group = ROUTE_GROUPS.get(endpoint, 'default')
+    return 'stream' if streaming and group in STREAMABLE_GROUPS else group
+
+
+_limiter = None
+
+
+def get_limiter():
+    """The process-wide limiter, or None when rate limiting is disabled."""
+    global _limiter
+    if os.environ.get('RATELIMIT_ENABLED', '1') == '0':
+        return None
+    if _limiter is None:
+        _limiter = RateLimiter(backend_from_url(os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')), load_limits())
+    return _limiter
+
+
+def setup_rate_limits(app):
+    limiter = get_limiter()
+    if limiter is None:
+        return
+
+    @app.before_request
+    def check_rate_limit():
+        if request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        # Requests src/asgi.py charged before handing them over carry their decision
+        decision = request.environ.get('ratelimit.decision')
+        if decision is None:
+            client = client_key(request.headers.get('X-API-Key'), request.remote_addr,
+                                request.headers.get('X-Forwarded-For'))
+            decision = limiter.hit(route_group(request.endpoint, 'stream' in request.args), client)
+        g.rate_limit = decision
+        if not decision.allowed:
+            response = jsonify({"msg": f"Demasiadas solicitudes, intente de nuevo en {math.ceil(decision.retry_after)} segundos"})
+            response.status_code = 429
+            response.headers.update(decision.headers())
+            return response
+        return None
+
+    @app.after_request
+    def rate_limit_headers(response):
+        decision = g.get('rate_limit')
+        if decision is not None and decision.allowed:
+            response.headers.update(decision.headers())
+        return response
@@ -0,0 +1,186 @@
+"""
+Read-replica routing: GET and HEAD requests read from a replica, everything else (and every
+flush) goes to the primary.
+
+    DATABASE_REPLICA_URLS     comma separated replica URLs (default: none, all traffic on the primary)
+    REPLICA_MAX_LAG_SECONDS   replicas further behind the primary are skipped (default 5)
+    REPLICA_CHECK_INTERVAL    seconds between lag checks of a replica (default 1)
+    READ_YOUR_WRITES_SECONDS  after a successful write the client reads from the primary for this
+                              long (default 5)
+
+Read-your-writes is pinned twice. The `db_primary` cookie covers clients that keep cookies,
+whichever worker serves them. Each worker also remembers the clients that wrote through it,
+identified as the rate limits identify them (ratelimit.client_key: issued API key, else
+address), which covers clients without cookies, like API scripts and credential-less CORS
+requests, for the reads that reach the same worker. A cookie-less client whose next read is
+balanced to another worker can still read from a replica that has not caught up.
+
+Lag is measured on the table_version heartbeat every catalog write bumps: the newest
+`updated_at` on the primary minus the newest one on the replica. It only sees the writes that
+bump a table version (the catalog, and the favorites through favorite_count): a replica behind
+on users or favorites documents alone measures as caught up. A replica that cannot be
+reached or is too far behind is left out until a later check; with no usable replica the
+read falls back to the primary.
+
+A request keeps one engine for all its reads (read_bind), and the catalog cache keys its entries
+by it: a body read from a lagging replica is cached with the version it was read at, under that
+replica's keys, and never served to the requests that read from the primary.
+"""
+import itertools
+import os
+import time
+from threading import Lock
+from flask import g, request, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import func, select
+from ratelimit import client_key
+
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 1))
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'db_primary'
+MAX_RECENT_WRITERS = 100_000
+
+
+def replica_urls():
+    return [url.strip().replace('postgres://', 'postgresql://')
+            for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+
+def replica_binds(engine_options):
+    """SQLALCHEMY_BINDS entries for the configured replicas, keyed replica_0, replica_1, ..."""
+    return {f'replica_{n}': {'url': url, **engine_options(url)} for n, url in enumerate(replica_urls())}
+
+
+def _newest_write(engine):
+    from models import TableVersion
+    with engine.connect() as connection:
+        return connection.scalar(select(func.max(TableVersion.updated_at)))
+
+
+class ReplicaRouter:
+    """Round-robin choice among the replicas whose last measured lag is acceptable."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._status = {}
+        self._turn = itertools.count()
+
+    def _check(self, engine, primary):
+        try:
+            newest, replica_newest = _newest_write(primary), _newest_write(engine)
+        except Exception:  # an unreachable replica is skipped until the next check
+            return None
+        if newest is None or (replica_newest is not None and replica_newest >= newest):
+            return 0.0
+        if replica_newest is None:
+            return float('inf')
+        return (newest - replica_newest).total_seconds()
+
+    def lag(self, key, engine, primary):
+        now = time.monotonic()
+        checked_at, lag = self._status.get(key, (None, None))
+        if checked_at is not None and now - checked_at < REPLICA_CHECK_INTERVAL:
+            return lag
+        with self._lock:
+            checked_at, lag = self._status.get(key, (None, None))
+            if checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL:
+                lag = self._check(engine, primary)
+                self._status[key] = (time.monotonic(), lag)
+        return lag
+
+    def choose(self, engines):
+        replicas = sorted(key for key in engines if key and key.startswith('replica_'))
+        if not replicas:
+            return None
+        start = next(self._turn)
+        for n in range(len(replicas)):
+            key = replicas[(start + n) % len(replicas)]
+            lag = self.lag(key, engines[key], engines[None])
+            if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS:
+                return key
+        return None
+
+    def status(self):
+        """Last measured lag in seconds per replica, None when it was unreachable or never caught up."""
+        return {key: round(lag, 3) if lag is not None and lag != float('inf') else None
+                for key, (_, lag) in sorted(self._status.items())}
+
+
+router = ReplicaRouter()
+
+
+class RecentWriters:
+    """Clients that wrote through this worker, until READ_YOUR_WRITES_SECONDS after their write."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._until = {}
+
+    def add(self, client):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._until) >= MAX_RECENT_WRITERS:
+                self._until = {key: until for key, until in self._until.items() if until > now}
+            self._until[client] = now + READ_YOUR_WRITES_SECONDS
+
+    def pinned(self, client):
+        until = self._until.get(client)
+        return until is not None and until > time.monotonic()
+
+
+recent_writers = RecentWriters()
+
+
+def _client():
+    return client_key(request.headers.get('X-API-Key'), request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+
+def _reads_from_replica():
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+    return not request.cookies.get(STICKY_COOKIE) and not recent_writers.pinned(_client())
+
+
+def read_bind():
+    """
+    Bind key of the replica the reads of this request go to, None for the primary. Chosen by
+    the request's first read and kept for the others.
+    """
+    if not _reads_from_replica():
+        return None
+    if g.get('replica_bind') is None:
+        g.replica_bind = router.choose(current_app.extensions['sqlalchemy'].engines) or False
+    return g.replica_bind or None
+
+
+class RoutingSession(Session):
+    """
+    Session sending the reads of GET/HEAD requests to a replica. Flushes, explicit binds and
+    every other request keep the primary, so a transaction never writes to a replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            key = read_bind()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def has_replicas(app):
+    return any(key and key.startswith('replica_') for key in app.config.get('SQLALCHEMY_BINDS', {}))
+
+
+def setup_replicas(app):
+    if not has_replicas(app):
+        return
+
+    @app.after_request
+    def read_your_writes(response):
+        # A client that just wrote keeps reading from the primary until replicas caught up
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=READ_YOUR_WRITES_SECONDS, httponly=True)
+            recent_writers.add(_client())
+        return response
@@ -0,0 +1,157 @@
+"""
+Ranked name search over the catalog (People, Planet, Starship).
+Postgres answers it with its trigram / full-text indexes, any other database
+with an in-process inverted index rebuilt whenever the names of a catalog table change
+(models.names_version: inserts, deletes and renames, not favorites).
+"""
+import re
+from bisect import bisect_left
+from threading import Lock
+from flask import request, jsonify, url_for
+from sqlalchemy import select, func, literal, or_
+from utils import APIException
+from pagination import int_arg
+from models import db, People, Planet, Starship, get_table_version, names_version
+
+SEARCH_TYPES = {'people': People, 'planets': Planet, 'starships': Starship}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class InvertedIndex:
+    """Token -> documents postings plus a sorted vocabulary, so prefix lookups are a bisect away."""
+
+    def __init__(self):
+        self.names = {}
+        self.postings = {}
+        self.vocabulary = []
+
+    def add(self, doc, name):
+        self.names[doc] = name
+        for token in tokenize(name):
+            self.postings.setdefault(token, set()).add(doc)
+
+    def freeze(self):
+        self.vocabulary = sorted(self.postings)
+
+    def expand(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, query, types):
+        """Documents matching every query token (as a word prefix), best matches first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for word in self.expand(token):
+                weight = 3 if word == token else 1
+                for doc in self.postings[word]:
+                    if doc[0] in types and token_scores.get(doc, 0) < weight:
+                        token_scores[doc] = weight
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc: score + token_scores[doc] for doc, score in scores.items() if doc in token_scores}
+            if not scores:
+                return []
+        query = query.strip().lower()
+        for doc in scores:
+            if self.names[doc].lower() == query:
+                scores[doc] += 5
+        return sorted(((score, doc) for doc, score in scores.items()),
+                      key=lambda item: (-item[0], len(self.names[item[1]]), item[1]))
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+        self._versions = None
+
+    def current(self):
+        versions = tuple(get_table_version(names_version(model.__tablename__))[0] for model in SEARCH_TYPES.values())
+        if versions != self._versions:
+            with self._lock:
+                if versions != self._versions:
+                    self._index = self._build()
+                    self._versions = versions
+        return self._index
+
+    def _build(self):
+        index = InvertedIndex()
+        for kind, model in SEARCH_TYPES.items():
+            stmt = select(model.id, model.name).execution_options(yield_per=5000)
+            for entity_id, name in db.session.execute(stmt):
+                index.add((kind, entity_id), name)
+        index.freeze()
+        return index
+
+
+catalog_index = CatalogIndex()
+
+
+def _search_in_process(query, types, limit, offset):
+    index = catalog_index.current()
+    ranked = index.search(query, types)
+    page = ranked[offset:offset + limit]
+    return [{"type": kind, "id": entity_id, "name": index.names[(kind, entity_id)], "score": score}
+            for score, (kind, entity_id) in page], len(ranked)
+
+
+def _search_postgres(query, types, limit, offset):
+    tokens = tokenize(query)
+    if not tokens:
+        return [], 0
+    # 'luke sky' -> 'luke:* & sky:*', served by the GIN to_tsvector indexes; similarity() by the trigram ones
+    tsquery = func.to_tsquery('simple', ' & '.join(f'{token}:*' for token in tokens))
+    selects = []
+    for kind in types:
+        model = SEARCH_TYPES[kind]
+        document = func.to_tsvector('simple', model.name)
+        score = func.ts_rank(document, tsquery) + func.similarity(model.name, query)
+        selects.append(
+            select(literal(kind).label('type'), model.id, model.name, score.label('score'))
+            .where(or_(document.op('@@')(tsquery), model.name.op('%')(query))))
+    union = selects[0].union_all(*selects[1:]).subquery()
+    total = db.session.execute(select(func.count()).select_from(union)).scalar()
+    rows = db.session.execute(
+        select(union).order_by(union.c.score.desc(), func.length(union.c.name), union.c.id)
+        .limit(limit).offset(offset))
+    return [{"type": row.type, "id": row.id, "name": row.name, "score": round(row.score, 4)}
+            for row in rows], total
+
+
+def search_catalog():
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise APIException("Debe enviar el parámetro 'q'", status_code=400)
+    types = request.args.get('type')
+    types = types.split(',') if types else list(SEARCH_TYPES)
+    unknown = [kind for kind in types if kind not in SEARCH_TYPES]
+    if unknown:
+        raise APIException(f"Tipo desconocido: '{unknown[0]}'", status_code=400)
+    limit = min(int_arg('limit', DEFAULT_LIMIT, minimum=1), MAX_LIMIT)
+    offset = int_arg('offset', 0)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        data, total = _search_postgres(query, types, limit, offset)
+    else:
+        data, total = _search_in_process(query, set(types), limit, offset)
+
+    next_url = None
+    if offset + limit < total:
+        args = request.args.to_dict()
+        args.update(offset=offset + limit, limit=limit)
+        next_url = url_for(request.endpoint, _external=True, **args)
+    return jsonify({"data": data, "total": total, "next": next_url}), 200
@@ -0,0 +1,109 @@
+"""
+Sparse fieldsets (`fields=`) and precompiled row serializers for the list endpoints
+"""
+import enum
+import json
+from functools import lru_cache
+from operator import attrgetter
+from flask import request
+from sqlalchemy import Enum
+from sqlalchemy.orm import load_only, selectinload
+from utils import APIException
+from favorite_documents import user_favorites, rebuild_cleared
+from models import User, People, Planet, Starship
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speed-up
+    orjson = None
+
+# Fields each model exposes, in the order of its serializable() / serialize() output
+PUBLIC_FIELDS = {
+    People: ('id', 'name', 'gender', 'height', 'favorite_count'),
+    Planet: ('id', 'name', 'size', 'population', 'climate', 'favorite_count'),
+    Starship: ('id', 'name', 'cost_in_credits', 'speed', 'favorite_count'),
+    User: ('id', 'email', 'password', 'username', 'name',
+           'favorite_people', 'favorite_starships', 'favorite_planets'),
+}
+
+
+def dumps(value):
+    """JSON bytes, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def parse_fields(model):
+    """The `fields=a,b` requested for `model`, or all of its public fields."""
+    allowed = PUBLIC_FIELDS[model]
+    requested = request.args.get('fields')
+    if not requested:
+        return allowed
+    fields = tuple(dict.fromkeys(field.strip() for field in requested.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise APIException(f"Campo desconocido: '{unknown[0] if unknown else requested}'", status_code=400)
+    return fields
+
+
+@lru_cache(maxsize=None)
+def row_serializer(model, fields):
+    """
+    Compiles a function turning a Core row whose first columns are `fields` into a dict,
+    so list endpoints never build ORM objects. One function per (model, fields) combination.
+    """
+    enums = [i for i, field in enumerate(fields) if isinstance(model.__table__.c[field].type, Enum)]
+    if not enums:
+        return lambda row: dict(zip(fields, row))
+
+    def serialize(row):
+        values = list(row[:len(fields)])
+        for i in enums:
+            if isinstance(values[i], enum.Enum):
+                values[i] = values[i].value
+        return dict(zip(fields, values))
+    return serialize
+
+
+def row_columns(model, fields, order=()):
+    """Columns to select: the requested fields first, then whatever the keyset order needs."""
+    columns = [model.__table__.c[field] for field in fields]
+    for column in [model.id, *(column for column, _ in order)]:
+        if column.key not in fields:
+            columns.append(model.__table__.c[column.key])
+    return columns
+
+
+# User field -> key of the favorites document holding it
+USER_FAVORITE_FIELDS = {'favorite_people': 'people', 'favorite_starships': 'starships', 'favorite_planets': 'planets'}
+
+
+def user_load_options(fields):
+    columns = [User.id, *(getattr(User, field) for field in fields if field not in USER_FAVORITE_FIELDS)]
+    if any(field in USER_FAVORITE_FIELDS for field in fields):
+        # One SELECT of the materialized documents for the whole page
+        return load_only(*columns), selectinload(User.favorites_document)
+    return load_only(*columns),
+
+
+def user_prepare(fields):
+    """The list_response `prepare` of the users: cleared favorites documents rebuilt a page at a time."""
+    if any(field in USER_FAVORITE_FIELDS for field in fields):
+        return rebuild_cleared
+    return None
+
+
+@lru_cache(maxsize=None)
+def user_serializer(fields):
+    """Same output as User.serialize restricted to `fields`, touching only the attributes it needs."""
+    getters = [(field, attrgetter(field)) for field in fields if field not in USER_FAVORITE_FIELDS]
+    favorites = [(field, USER_FAVORITE_FIELDS[field]) for field in fields if field in USER_FAVORITE_FIELDS]
+
+    def serialize(user):
+        data = {field: getter(user) for field, getter in getters}
+        if favorites:
+            document = user_favorites(user)
+            data.update((field, document[kind]) for field, kind in favorites)
+        return data
+    return serialize
@@ -0,0 +1,214 @@
+"""
+Request coalescing ("single flight"): while one caller computes the value of a key, concurrent
+callers asking for the same key wait for it and share the result instead of repeating the work.
+
+    SINGLEFLIGHT_DIR       directory for lock and result files, shared by every worker process of
+                           the host (gunicorn -w N); unset coalesces within each process only
+    SINGLEFLIGHT_TIMEOUT   seconds a caller waits for another one before computing on its own (default 10)
+
+Within a process, callers wait on an Event. Across processes, the caller that leads in its
+process also takes an flock on the key's lock file; the leader writes its result next to it
+and the leaders of other processes, once they get the lock, reuse that result when it was
+written after they started waiting. `AsyncSingleFlight` does the same for asyncio tasks of one
+event loop (src/asgi.py).
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import pickle
+import struct
+import threading
+import time
+
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('SINGLEFLIGHT_TIMEOUT', 10))
+RESULT_MAX_AGE = 60
+_HEADER = struct.Struct('<d')
+_MISSING = object()
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _acquire(lock_file, deadline):
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.time() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+
+def _read_result(path, since):
+    """The value stored at `path` if it was written at or after `since`."""
+    try:
+        with open(path, 'rb') as result_file:
+            header = result_file.read(_HEADER.size)
+            if len(header) < _HEADER.size or _HEADER.unpack(header)[0] < since:
+                return _MISSING
+            return pickle.load(result_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return _MISSING
+
+
+def _write_result(path, value):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        with open(tmp_path, 'wb') as result_file:
+            result_file.write(_HEADER.pack(time.time()))
+            pickle.dump(value, result_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # Values that cannot be pickled are simply not shared with other processes
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, timeout=SINGLEFLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        self.leaders = 0
+        self.shared = 0
+        self.shared_across_processes = 0
+        self.timeouts = 0
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, fn, epoch=None):
+        """
+        Returns `fn()`, or the result of the identical call already in flight. Exceptions are
+        shared the same way. `epoch` separates calls of this process started before and after
+        an invalidation; only `key` (its repr) identifies the call across processes.
+        """
+        call_key = (key, epoch)
+        with self._lock:
+            call = self._calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._calls[call_key] = _Call()
+                self.leaders += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn()
+            with self._lock:
+                self.shared += 1
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._run(key, fn)
+            return call.value
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[call_key]
+            call.done.set()
+
+    def _run(self, key, fn):
+        if not self.lock_dir:
+            return fn()
+        started = time.time()
+        name = os.path.join(self.lock_dir, hashlib.sha1(repr(key).encode()).hexdigest())
+        with open(name + '.lock', 'a') as lock_file:
+            if not _acquire(lock_file, started + self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn()
+            try:
+                value = _read_result(name + '.result', started)
+                if value is not _MISSING:
+                    with self._lock:
+                        self.shared_across_processes += 1
+                    return value
+                value = fn()
+                _write_result(name + '.result', value)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        if started >= self._next_prune:
+            self._prune(started)
+        return value
+
+    def _prune(self, now):
+        # Results are only useful to callers already waiting, so old files can go
+        self._next_prune = now + RESULT_MAX_AGE
+        with os.scandir(self.lock_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < now - RESULT_MAX_AGE:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "shared_across_processes": self.shared_across_processes,
+                "timeouts": self.timeouts,
+                "lock_dir": self.lock_dir
+            }
+
+
+class AsyncSingleFlight:
+    """Coalesces coroutines of one event loop: concurrent `await do(key, fn)` run `fn()` once."""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        while (future := self._calls.get(key)) is not None:
+            try:
+                value = await asyncio.shield(future)
+                self.shared += 1
+                return value
+            except asyncio.CancelledError:
+                # The leader was cancelled (its client went away): take over unless this task was
+                if not future.cancelled():
+                    raise
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            value = await fn()
+        except Exception as error:
+            future.set_exception(error)
+            # Marks the exception as retrieved when no other task was waiting for it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._calls[key]
+
+
+flights = SingleFlight(lock_dir=os.environ.get('SINGLEFLIGHT_DIR') or None)
@@ -0,0 +1,390 @@
+"""
+Catalog snapshots: People, Planet and Starship plus the favorites tables in a compact columnar
+binary file, to rebuild an environment and to serve the catalog without reading the database.
+
+    flask snapshot export catalog.snap
+    flask snapshot import catalog.snap [--replace]
+    flask snapshot info catalog.snap
+
+    CATALOG_SNAPSHOT   snapshot file the catalog reads (entities by id, plain pages) are served from,
+                       for each table as long as the database holds the snapshot's content
+
+File layout (little-endian): MAGIC, the format version (u32) and the length (u32) of a JSON
+directory of tables and columns, then each column as blocks aligned to 8 bytes:
+
+    int     int64 values
+    str     u32 offsets (rows + 1) into a block of UTF-8 text
+    dict    u8 codes into the directory's list of values (text columns with few distinct values)
+
+Blocks are read in place through mmap: opening a snapshot only parses the directory, and the
+worker processes of a host share its pages. Imports load the rows with COPY on PostgreSQL
+(psycopg2) and chunked executemany INSERTs elsewhere, in one transaction.
+
+Every table of the directory carries a content id, the SHA-256 of its columns. The export
+records it in the table_version rows of the database it read, and an import that loaded the
+table exactly as it is in the file records it in the target database; the next write to the
+table clears it. A table is served from the file only while its table_version row holds the
+file's id: version numbers are local to each database and cannot tell two catalogs apart.
+"""
+import bisect
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+import click
+from flask import g
+from sqlalchemy import Enum, Integer, select, insert, delete, update, func, text
+from changes import publish, CATALOG_CHANGE_TYPES
+from serializers import PUBLIC_FIELDS
+from models import db, User, People, Planet, Starship, FavoritePeople, FavoriteStarships, FavoritePlanets, \
+    FavoritesDocument, TableVersion, FAVORITE_TARGETS, bump_table_version, names_version
+
+MAGIC = b'SWCATSNP'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sII')
+MAX_DICTIONARY_SIZE = 256
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_ATTEMPTS = 3
+
+CATALOG_MODELS = (People, Planet, Starship)
+FAVORITE_MODELS = (FavoritePeople, FavoriteStarships, FavoritePlanets)
+# model -> exported columns; catalog rows keep their ids and row versions (entity ETags), favorites
+# rows are listed in id order
+SNAPSHOT_COLUMNS = {
+    **{model: (*PUBLIC_FIELDS[model], 'version') for model in CATALOG_MODELS},
+    **{model: ('user_id', FAVORITE_TARGETS[model][0]) for model in FAVORITE_MODELS},
+}
+
+
+def _align(size):
+    return -size % 8
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _encode_column(kind, values):
+    """(directory entry, blocks) of a column."""
+    if kind == 'int':
+        return {'type': 'int'}, [_little_endian(array('q', values))]
+    distinct = sorted(set(values))
+    if len(distinct) <= MAX_DICTIONARY_SIZE:
+        codes = {value: code for code, value in enumerate(distinct)}
+        return {'type': 'dict', 'values': distinct}, [bytes(codes[value] for value in values)]
+    encoded = [value.encode() for value in values]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return {'type': 'str'}, [_little_endian(offsets), b''.join(encoded)]
+
+
+def write_snapshot(path, tables):
+    """
+    Writes `tables` ({name: {'version', 'columns': {column: (kind, values)}}}) to `path`,
+    replacing it only once the new file is complete. Returns the content id of every table.
+    """
+    directory = {'format': FORMAT_VERSION, 'created_at': datetime.now(timezone.utc).isoformat(), 'tables': {}}
+    blocks, position = [], 0
+    for name, table in tables.items():
+        columns, rows = {}, 0
+        content = hashlib.sha256()
+        for column, (kind, values) in table['columns'].items():
+            entry, parts = _encode_column(kind, values)
+            content.update(json.dumps([column, entry], separators=(',', ':')).encode())
+            entry['blocks'] = []
+            for part in parts:
+                content.update(part)
+                entry['blocks'].append([position, len(part)])
+                blocks += [part, b'\0' * _align(len(part))]
+                position += len(part) + _align(len(part))
+            columns[column] = entry
+            rows = len(values)
+        directory['tables'][name] = {'rows': rows, 'version': table['version'], 'id': content.hexdigest(),
+                                     'columns': columns}
+
+    header = json.dumps(directory, separators=(',', ':')).encode()
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        snapshot_file.write(header + b'\0' * _align(_PREFIX.size + len(header)))
+        for block in blocks:
+            snapshot_file.write(block)
+    os.replace(tmp_path, path)
+    return {name: table['id'] for name, table in directory['tables'].items()}
+
+
+def _cast(block, code):
+    if sys.byteorder == 'little':
+        return block.cast(code)
+    values = array(code, block)
+    values.byteswap()
+    return values
+
+
+class SnapshotColumn:
+    def __init__(self, entry, data):
+        self.type = entry['type']
+        blocks = [data[offset:offset + length] for offset, length in entry['blocks']]
+        if self.type == 'int':
+            self._values = _cast(blocks[0], 'q')
+        elif self.type == 'dict':
+            self._codes, self._dictionary = blocks[0], entry['values']
+        else:
+            self._offsets, self._text = _cast(blocks[0], 'I'), blocks[1]
+
+    def __getitem__(self, index):
+        if self.type == 'int':
+            return self._values[index]
+        if self.type == 'dict':
+            return self._dictionary[self._codes[index]]
+        return str(self._text[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __len__(self):
+        if self.type == 'int':
+            return len(self._values)
+        return len(self._codes) if self.type == 'dict' else len(self._offsets) - 1
+
+
+class SnapshotTable:
+    def __init__(self, name, entry, data):
+        self.name = name
+        self.rows = entry['rows']
+        self.version = entry['version']
+        # Content id, absent from files written before it existed
+        self.id = entry.get('id')
+        self.columns = {column: SnapshotColumn(column_entry, data) for column, column_entry in entry['columns'].items()}
+
+    def row(self, index, fields):
+        return {field: self.columns[field][index] for field in fields}
+
+    def get(self, entity_id, fields):
+        """The row with that id (catalog tables are sorted by id), or None."""
+        ids = self.columns['id']
+        index = bisect.bisect_left(ids, entity_id)
+        if index < self.rows and ids[index] == entity_id:
+            return self.row(index, fields)
+        return None
+
+    def page(self, after, limit, fields):
+        """Rows after the `after` id and the cursor of the next page, as pagination.keyset_page pages by id."""
+        ids = self.columns['id']
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        end = min(start + limit, self.rows)
+        next_after = str(ids[end - 1]) if end < self.rows else None
+        return [self.row(index, fields) for index in range(start, end)], next_after
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size = _PREFIX.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{path} has snapshot format {version}, this version reads {FORMAT_VERSION}')
+        self.directory = json.loads(self._mmap[_PREFIX.size:_PREFIX.size + header_size])
+        start = _PREFIX.size + header_size + _align(_PREFIX.size + header_size)
+        data = memoryview(self._mmap)[start:]
+        self.tables = {name: SnapshotTable(name, entry, data) for name, entry in self.directory['tables'].items()}
+
+
+def _plain(value):
+    return value.value if hasattr(value, 'value') else value
+
+
+def _versions(connection):
+    return dict(connection.execute(select(TableVersion.table_name, TableVersion.version)).all())
+
+
+def export_snapshot(path):
+    """Writes the catalog and favorites to `path`; returns {table: rows}."""
+    for _ in range(EXPORT_ATTEMPTS):
+        with db.engine.connect() as connection:
+            versions = _versions(connection)
+            tables = {}
+            for model, columns in SNAPSHOT_COLUMNS.items():
+                table = model.__table__
+                rows = connection.execute(select(*(table.c[column] for column in columns)).order_by(table.c.id)).all()
+                tables[table.name] = {
+                    'version': versions.get(table.name),
+                    'columns': {column: ('int' if isinstance(table.c[column].type, Integer) else 'str',
+                                         [_plain(row[i]) for row in rows]) for i, column in enumerate(columns)},
+                }
+            # Every catalog or favorites write bumps a catalog table version: unchanged versions
+            # mean the tables were read in a consistent state
+            if _versions(connection) == versions:
+                ids = write_snapshot(path, tables)
+                _record_export(ids, versions)
+                return {name: len(next(iter(table['columns'].values()))[1]) for name, table in tables.items()}
+    raise click.ClickException('The catalog kept changing while it was exported, try again')
+
+
+def _record_export(ids, versions):
+    """Records the content ids in the table_version rows of the catalog tables not written since they were read."""
+    now = datetime.now(timezone.utc)
+    with db.engine.begin() as connection:
+        for model in CATALOG_MODELS:
+            name = model.__tablename__
+            if versions.get(name) is None:
+                connection.execute(insert(TableVersion).values(table_name=name, version=0, updated_at=now,
+                                                               snapshot_id=ids[name]))
+            else:
+                connection.execute(update(TableVersion)
+                                   .where(TableVersion.table_name == name, TableVersion.version == versions[name])
+                                   .values(snapshot_id=ids[name]))
+
+
+def _copy_value(value):
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _load(connection, model, columns, rows):
+    """Inserts `rows` (tuples of `columns` values, as the database stores them) into `model`'s table."""
+    table = model.__table__
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        buffer = io.StringIO(''.join('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows))
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN', buffer)
+        return
+    rows = list(rows)
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        connection.execute(insert(table), [dict(zip(columns, row)) for row in rows[start:start + IMPORT_CHUNK_SIZE]])
+
+
+def _database_values(connection, model, table, columns):
+    """The snapshot rows of `columns` as the database stores them (enum names for COPY, members otherwise)."""
+    converters = []
+    for column in columns:
+        column_type = model.__table__.c[column].type
+        if isinstance(column_type, Enum) and column_type.enum_class is not None:
+            enum_class = column_type.enum_class
+            if connection.dialect.name == 'postgresql':
+                converters.append(lambda value, enum_class=enum_class: enum_class(value).name)
+            else:
+                converters.append(enum_class)
+        else:
+            converters.append(None)
+    values = [table.columns[column] for column in columns]
+    for index in range(table.rows):
+        yield tuple(convert(column[index]) if convert else column[index] for column, convert in zip(values, converters))
+
+
+def import_snapshot(snapshot, replace=False):
+    """
+    Loads a snapshot into empty catalog and favorites tables (emptied first with `replace`), in
+    one transaction. Favorites of users missing from this database are skipped. Returns
+    ({table: rows loaded}, favorites skipped).
+    """
+    loaded, skipped = {}, 0
+    with db.engine.begin() as connection:
+        if replace:
+            for model in (*FAVORITE_MODELS, *CATALOG_MODELS):
+                connection.execute(delete(model))
+        elif any(connection.scalar(select(func.count()).select_from(model)) for model in (*CATALOG_MODELS, *FAVORITE_MODELS)):
+            raise click.ClickException('The catalog is not empty: import with --replace to overwrite it')
+
+        for model in CATALOG_MODELS:
+            table = snapshot.tables[model.__tablename__]
+            # favorite_count is recomputed from the favorites actually loaded
+            columns = [column for column in SNAPSHOT_COLUMNS[model] if column != 'favorite_count']
+            _load(connection, model, columns, _database_values(connection, model, table, columns))
+            loaded[model.__tablename__] = table.rows
+
+        users = set(connection.execute(select(User.id)).scalars())
+        for model in FAVORITE_MODELS:
+            table = snapshot.tables[model.__tablename__]
+            columns = SNAPSHOT_COLUMNS[model]
+            rows = [row for row in _database_values(connection, model, table, columns) if row[0] in users]
+            _load(connection, model, columns, rows)
+            loaded[model.__tablename__] = len(rows)
+            skipped += table.rows - len(rows)
+
+        for model in FAVORITE_MODELS:
+            column, entity_model = FAVORITE_TARGETS[model]
+            connection.execute(update(entity_model).values(favorite_count=select(func.count()).select_from(model)
+                               .where(getattr(model, column) == entity_model.id).scalar_subquery()))
+        for model in CATALOG_MODELS:
+            if connection.dialect.name == 'postgresql':
+                # Rows were inserted with their ids: move the sequence past them
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{model.__tablename__}', 'id'), "
+                                        f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {model.__tablename__}), false)"))
+            # Only a complete copy holds the snapshot's content: skipped favorites change favorite_count
+            bump_table_version(connection, model.__tablename__,
+                               snapshot.tables[model.__tablename__].id if not skipped else None)
+            bump_table_version(connection, names_version(model.__tablename__))
+            publish(connection, CATALOG_CHANGE_TYPES[model], 'imported', count=loaded[model.__tablename__])
+        connection.execute(update(FavoritesDocument).values(document=None, generation=FavoritesDocument.generation + 1))
+    return loaded, skipped
+
+
+_served = None
+
+
+def snapshot_open():
+    """Whether a CATALOG_SNAPSHOT is open; served_table tells whether a table is served from it."""
+    return _served is not None
+
+
+def _database_snapshot_id(table_name):
+    """Content id of the snapshot the table holds (table_version.snapshot_id), read once per request."""
+    ids = g.setdefault('snapshot_ids', {})
+    if table_name not in ids:
+        ids[table_name] = db.session.scalar(select(TableVersion.snapshot_id).where(TableVersion.table_name == table_name))
+    return ids[table_name]
+
+
+def served_table(model):
+    """The CATALOG_SNAPSHOT table of `model` while the database holds the same content, else None."""
+    if _served is None:
+        return None
+    table = _served.tables.get(model.__tablename__)
+    if table is None or table.id is None or table.id != _database_snapshot_id(model.__tablename__):
+        return None
+    return table
+
+
+def setup_snapshot(app):
+    global _served
+    path = os.environ.get('CATALOG_SNAPSHOT')
+    if path:
+        _served = Snapshot(path)
+
+    @app.cli.group('snapshot')
+    def snapshot_cli():
+        """Catalog snapshots."""
+
+    @snapshot_cli.command('export')
+    @click.argument('path', type=click.Path(dir_okay=False))
+    def export_command(path):
+        """Writes the catalog and favorites to PATH."""
+        counts = export_snapshot(path)
+        click.echo(f'{path}: {os.path.getsize(path)} bytes, ' + ', '.join(f'{name} {rows}' for name, rows in counts.items()))
+
+    @snapshot_cli.command('import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--replace', is_flag=True, help='Delete the current catalog and favorites first.')
+    def import_command(path, replace):
+        """Loads the catalog and favorites of the snapshot at PATH."""
+        loaded, skipped = import_snapshot(Snapshot(path), replace)
+        click.echo(', '.join(f'{name} {rows}' for name, rows in loaded.items()))
+        if skipped:
+            click.echo(f'{skipped} favorites of users missing from this database were skipped')
+
+    @snapshot_cli.command('info')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    def info_command(path):
+        """Describes the snapshot at PATH."""
+        directory = Snapshot(path).directory
+        click.echo(f"format {directory['format']}, created {directory['created_at']}")
+        for name, table in directory['tables'].items():
+            columns = ', '.join(f"{column}:{entry['type']}" for column, entry in table['columns'].items())
+            click.echo(f"{name}: {table['rows']} rows, version {table['version']}, id {table.get('id')} ({columns})")
@@ -0,0 +1,40 @@
+import os
+import sys
+import pytest
+
+# The app's modules are flat under src/ and import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """
+    Builds apps on SQLite files of tmp_path (`make_app('a')` -> a.db), with rate limits off.
+    The process-wide catalog cache and leaderboards are emptied for every app: a worker serves
+    a single database.
+    """
+    from app import create_app
+    from cache import catalog_cache
+    from leaderboard import Leaderboard, leaderboards
+    from models import db
+    import snapshot
+
+    monkeypatch.setenv('RATELIMIT_ENABLED', '0')
+    monkeypatch.setattr(snapshot, '_served', None)
+    apps = []
+
+    def make(name='test', **config):
+        catalog_cache.clear()
+        for model in leaderboards:
+            monkeypatch.setitem(leaderboards, model, Leaderboard(model))
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / name}.db', 'ADMIN': False, **config})
+        with app.app_context():
+            db.create_all(bind_key=None)
+        apps.append(app)
+        return app
+
+    yield make
+    catalog_cache.clear()
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
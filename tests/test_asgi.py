@@ -0,0 +1,156 @@
+"""
+The async handlers of src/asgi.py answer like the Flask routes they stand for.
+"""
+import asyncio
+import importlib
+import json
+import pytest
+import snapshot
+from cache import catalog_cache
+from models import db, User, People, GenderEnum, FavoritePeople
+
+URLS = [
+    '/people',
+    '/people?limit=2',
+    '/people?limit=2&after=2',
+    '/people?limit=5000',
+    '/people?limit=0',
+    '/people?limit=abc',
+    '/people/1',
+    '/people/404',
+    '/users/1/favorites',
+]
+# Refused by the Flask route: the async handler hands them over
+FLASK_URLS = {'/people?limit=0', '/people?limit=abc'}
+
+
+@pytest.fixture
+def asgi(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "asgi.db"}')
+    monkeypatch.setenv('RATELIMIT_ENABLED', '0')
+    monkeypatch.setenv('ENABLE_ADMIN', '0')
+    monkeypatch.setattr(snapshot, '_served', None)
+    module = importlib.reload(importlib.import_module('asgi'))
+    with module.flask_app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add_all(People(id=i, name=f'Person {i}', gender=GenderEnum.FEMALE, height=150 + i) for i in range(1, 6))
+        db.session.add(User(id=1, email='user1@example.com', password='secret', username='user1', name='User 1'))
+        db.session.flush()
+        db.session.add(FavoritePeople(user_id=1, people_id=3))
+        db.session.commit()
+    catalog_cache.clear()
+    yield module
+    catalog_cache.clear()
+    asyncio.run(module.engine.dispose())
+    with module.flask_app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def handed_over(asgi, monkeypatch):
+    """Paths of the requests the async handlers handed to the Flask app."""
+    paths = []
+    call_wsgi = asgi.call_wsgi
+
+    async def recording_call_wsgi(scope, receive, send):
+        paths.append(scope['path'])
+        await call_wsgi(scope, receive, send)
+    monkeypatch.setattr(asgi, 'call_wsgi', recording_call_wsgi)
+    return paths
+
+
+def call_async(asgi, url, headers=()):
+    path, _, query = url.partition('?')
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'root_path': '',
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+             'client': ('127.0.0.1', 50000), 'server': ('localhost', 80), 'scheme': 'http', 'http_version': '1.1'}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    response_headers = {name.decode(): value.decode() for name, value in messages[0]['headers']}
+    return messages[0]['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def call_flask(asgi, url, headers=()):
+    response = asgi.flask_app.test_client().get(url, headers=dict(headers))
+    return response.status_code, response.headers, response.get_data()
+
+
+@pytest.mark.parametrize('url', URLS)
+def test_same_response_on_both_stacks(asgi, handed_over, url):
+    flask_status, flask_headers, flask_body = call_flask(asgi, url)
+    catalog_cache.clear()
+    status, headers, body = call_async(asgi, url)
+
+    assert bool(handed_over) == (url in FLASK_URLS)
+    assert status == flask_status
+    assert json.loads(body) == json.loads(flask_body)
+    assert headers.get('etag') == flask_headers.get('ETag')
+    assert headers.get('last-modified') == flask_headers.get('Last-Modified')
+
+    if 'etag' in headers:
+        catalog_cache.clear()
+        assert call_async(asgi, url, [('If-None-Match', headers['etag'])])[0] == 304
+
+
+def requests_recorded(asgi, route):
+    prefix = f'http_request_duration_seconds_count{{method="GET",route="{route}",status="200"}} '
+    return sum(int(line[len(prefix):]) for line in asgi.registry.render().splitlines() if line.startswith(prefix))
+
+
+def test_async_requests_are_measured(asgi):
+    before = requests_recorded(asgi, '/people/<int:people_id>')
+    assert call_async(asgi, '/people/2')[0] == 200
+    assert requests_recorded(asgi, '/people/<int:people_id>') == before + 1
+
+
+def read_sse(asgi, headers, count):
+    """The status and the first `count` Server-Sent Events of GET /changes, then disconnects."""
+    scope = {'type': 'http', 'method': 'GET', 'path': '/changes', 'query_string': b'', 'root_path': '',
+             'headers': [(name.lower().encode(), value.encode()) for name, value in
+                         [('Accept', 'text/event-stream'), *headers]],
+             'client': ('127.0.0.1', 50000), 'server': ('localhost', 80), 'scheme': 'http', 'http_version': '1.1'}
+    messages = []
+
+    async def run():
+        received = asyncio.Event()
+
+        async def receive():
+            await received.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if b''.join(message.get('body', b'') for message in messages[1:]).count(b'\ndata: ') >= count:
+                received.set()
+
+        await asyncio.wait_for(asgi.app(scope, receive, send), timeout=10)
+
+    asyncio.run(run())
+    body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+    events = [dict(line.split(': ', 1) for line in block.splitlines())
+              for block in body.split('\n\n') if block.startswith('id: ')]
+    return messages[0]['status'], events
+
+
+def test_sse_resumes_after_the_last_event_id(asgi):
+    client = asgi.flask_app.test_client()
+    start = client.get('/changes').get_json()['last_event_id']
+    assert client.post('/favorite/people/2').status_code == 201
+    assert client.delete('/favorite/people/3').status_code == 200
+    assert client.post('/people', json={'name': 'Leia Organa', 'gender': 'FEMALE', 'height': 150}).status_code == 201
+
+    status, events = read_sse(asgi, [('Last-Event-ID', str(start))], 3)
+    assert status == 200
+    assert [json.loads(event['data'])['action'] for event in events] == ['added', 'removed', 'created']
+    ids = [int(event['id']) for event in events]
+    assert ids == list(range(start + 1, start + 4))
+
+    _, resumed = read_sse(asgi, [('Last-Event-ID', str(ids[0]))], 2)
+    assert [int(event['id']) for event in resumed] == ids[1:]
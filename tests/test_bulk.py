@@ -0,0 +1,29 @@
+"""
+Bulk imports report invalid rows, out-of-range integers included, and insert the others.
+"""
+import pytest
+from sqlalchemy import select
+from models import db, Planet
+
+INT_MAX = 2 ** 31 - 1
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
+
+
+def planet(name, population):
+    return {'name': name, 'size': 12000, 'population': population, 'climate': 'arid'}
+
+
+def test_out_of_range_integers_are_row_errors(client):
+    response = client.post('/planets/bulk', json=[
+        planet('Tatooine', INT_MAX), planet('Coruscant', INT_MAX + 1), planet('Hoth', str(-INT_MAX - 2)),
+        planet('Naboo', -INT_MAX - 1)])
+    assert response.status_code == 201
+    assert response.get_json() == {'inserted': 2, 'errors': [
+        {'row': 1, 'msg': "Valor inválido para el campo 'population'"},
+        {'row': 2, 'msg': "Valor inválido para el campo 'population'"}]}
+    with client.application.app_context():
+        assert db.session.scalars(select(Planet.name).order_by(Planet.id)).all() == ['Tatooine', 'Naboo']
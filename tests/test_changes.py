@@ -0,0 +1,79 @@
+"""
+The change feed: the API writes publish their events, and clients resume after the last id they saw.
+"""
+import pytest
+from models import db, User, People, GenderEnum
+
+PLANET = {'name': 'Tatooine', 'size': 10465, 'population': 200000, 'climate': 'arid'}
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add_all(People(id=i, name=f'Person {i}', gender=GenderEnum.MALE, height=i) for i in range(1, 4))
+        db.session.add_all(User(id=i, email=f'user{i}@example.com', password='secret', username=f'user{i}',
+                                name=f'User {i}') for i in (1, 2))
+        db.session.commit()
+    return app
+
+
+def write_everything(client):
+    """Writes of every kind, two of them no-ops that publish nothing."""
+    assert client.post('/people', json={'name': 'Leia Organa', 'gender': 'FEMALE', 'height': 150}).status_code == 201
+    assert client.post('/favorite/people/1').status_code == 201
+    assert client.delete('/favorite/people/1').status_code == 200
+    assert client.delete('/favorite/people/1').status_code == 404
+    assert client.post('/planets/bulk', json=[PLANET, {**PLANET, 'name': 'Hoth'}]).status_code == 201
+    assert client.post('/users/2/favorites/bulk', json={'add': {'people': [3, 2]}}).status_code == 200
+    assert client.post('/users/2/favorites/bulk', json={'add': {'people': [2]}}).status_code == 200
+
+
+EVENTS = [
+    {'type': 'people', 'action': 'created', 'ids': [4]},
+    {'type': 'favorites', 'action': 'added', 'user_id': 1, 'kind': 'people', 'ids': [1]},
+    {'type': 'favorites', 'action': 'removed', 'user_id': 1, 'kind': 'people', 'ids': [1]},
+    {'type': 'planets', 'action': 'created', 'ids': [1, 2]},
+    {'type': 'favorites', 'action': 'added', 'user_id': 2, 'kind': 'people', 'ids': [2, 3]},
+]
+
+
+def changes(client, url='/changes', **headers):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_writes_publish_events(app):
+    client = app.test_client()
+    start = changes(client)
+    assert start['events'] == []
+    write_everything(client)
+
+    page = changes(client, **{'Last-Event-ID': str(start['last_event_id'])})
+    events = page['events']
+    assert [{key: value for key, value in event.items() if key != 'id'} for event in events] == EVENTS
+    assert [event['id'] for event in events] == list(range(start['last_event_id'] + 1, page['last_event_id'] + 1))
+    # Without an id the feed starts from now on
+    assert changes(client) == {'events': [], 'last_event_id': page['last_event_id']}
+
+
+def test_resume_after_the_last_event_id(app):
+    client = app.test_client()
+    start = changes(client)['last_event_id']
+    write_everything(client)
+    ids = [event['id'] for event in changes(client, f'/changes?after={start}')['events']]
+
+    resumed = changes(client, **{'Last-Event-ID': str(ids[2])})
+    assert [event['id'] for event in resumed['events']] == ids[3:]
+    assert resumed['last_event_id'] == ids[-1]
+    # `after` wins over the header, and `types` filters without holding back the cursor
+    filtered = changes(client, f'/changes?after={ids[0]}&types=favorites', **{'Last-Event-ID': str(ids[3])})
+    assert [event['id'] for event in filtered['events']] == [ids[1], ids[2], ids[4]]
+    assert filtered['last_event_id'] == ids[-1]
+    assert changes(client, **{'Last-Event-ID': str(ids[-1])}) == {'events': [], 'last_event_id': ids[-1]}
+
+
+@pytest.mark.parametrize('last_event_id', ['-1', 'abc'])
+def test_invalid_last_event_id(app, last_event_id):
+    assert app.test_client().get('/changes', headers={'Last-Event-ID': last_event_id}).status_code == 400
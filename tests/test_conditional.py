@@ -0,0 +1,71 @@
+"""
+ETags of the catalog reads: conditional requests answered with 304, and tags that change with
+every write to the table and with the query string.
+"""
+import pytest
+from models import db, User, People, GenderEnum, FavoritePeople
+
+PERSON = {'name': 'Leia Organa', 'gender': 'FEMALE', 'height': 150}
+# (method, url, json body, the person whose row the write changes)
+WRITES = [
+    ('post', '/people', PERSON, None),
+    ('post', '/people/bulk', [PERSON, {**PERSON, 'name': 'Han Solo'}], None),
+    ('post', '/favorite/people/1', None, 1),
+    ('delete', '/favorite/people/2', None, 2),
+]
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add_all(People(id=i, name=f'Person {i}', gender=GenderEnum.MALE, height=i) for i in range(1, 4))
+        db.session.add(User(id=1, email='user1@example.com', password='secret', username='user1', name='User 1'))
+        db.session.flush()
+        db.session.add(FavoritePeople(user_id=1, people_id=2))
+        db.session.commit()
+    return app
+
+
+@pytest.mark.parametrize('url', ['/people', '/people/1', '/people/top'])
+def test_if_none_match(app, url):
+    client = app.test_client()
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and not etag.startswith('W/')
+
+    not_modified = client.get(url, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert not_modified.headers['ETag'] == etag
+    # Compressed responses carry the weak form of the tag: it matches too
+    assert client.get(url, headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': f'"other", {etag}'}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize('method, url, body, person_id', WRITES)
+def test_writes_change_the_etag(app, method, url, body, person_id):
+    client = app.test_client()
+    urls = ['/people', '/people?limit=2'] + ([f'/people/{person_id}'] if person_id else [])
+    before = {read: client.get(read).headers['ETag'] for read in urls}
+    planets = client.get('/planets').headers['ETag']
+
+    assert getattr(client, method)(url, json=body).status_code in (200, 201)
+
+    for read in urls:
+        response = client.get(read, headers={'If-None-Match': before[read]})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != before[read]
+    # Other tables keep theirs
+    assert client.get('/planets', headers={'If-None-Match': planets}).status_code == 304
+
+
+def test_query_strings_have_their_own_etag(app):
+    client = app.test_client()
+    urls = ['/people', '/people?limit=1', '/people?limit=2', '/people?limit=1&after=1', '/people?stream=ndjson']
+    etags = [client.get(url).headers['ETag'] for url in urls]
+    assert len(set(etags)) == len(urls)
+    # Same query string, same tag
+    assert client.get('/people?limit=1').headers['ETag'] == etags[1]
+    assert client.get('/people?limit=2', headers={'If-None-Match': etags[1]}).status_code == 200
@@ -0,0 +1,66 @@
+"""
+Favorites written through the worker update its leaderboards in place, and reads of a
+current leaderboard run no query.
+"""
+import pytest
+from sqlalchemy import event
+import leaderboard
+from leaderboard import leaderboards
+from models import db, User, People, GenderEnum
+
+RELOAD = 'ORDER BY people.favorite_count DESC'
+
+
+@pytest.fixture
+def app(make_app, monkeypatch):
+    monkeypatch.setattr(leaderboard, 'LEADERBOARD_SIZE', 3)
+    app = make_app()
+    with app.app_context():
+        db.session.add_all(People(id=i, name=f'Person {i}', gender=GenderEnum.MALE, height=i) for i in range(1, 7))
+        db.session.add_all(User(id=i, email=f'user{i}@example.com', password='secret', username=f'user{i}',
+                                name=f'User {i}') for i in range(1, 5))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+# (user, operation, people ids, whether the next read reloads the board)
+WRITES = [
+    (1, 'add', [1, 2, 3, 4], False),   # onto an empty board: the new rows are read in the write
+    (2, 'add', [4], False),            # 4 enters a full board, 3 leaves it
+    (1, 'remove', [1], True),          # 1 leaves: a row off the board takes the free place
+    (3, 'add', [2], False),            # 2 climbs on the board
+    (4, 'add', [5], False),            # 5 ties 3 but ranks below it: the board is unchanged
+    (1, 'remove', [3], True),          # 3 leaves: 5, off the board, takes its place
+]
+
+
+def test_favorites_update_the_board_in_place(app, statements):
+    client = app.test_client()
+    assert client.get('/people/top').get_json() == []
+    for user_id, operation, ids, reloads in WRITES:
+        response = client.post(f'/users/{user_id}/favorites/bulk', json={operation: {'people': ids}})
+        assert response.status_code == 200
+
+        statements.clear()
+        top = client.get('/people/top').get_json()
+        assert any(RELOAD in statement for statement in statements) == reloads
+        with app.app_context():
+            assert top == leaderboards[People]._load()
+
+        statements.clear()
+        assert client.get('/people/top').get_json() == top
+        assert statements == []
@@ -0,0 +1,128 @@
+"""
+Query-count regression tests: the SQL statements run by GET /users and GET /users/<id>/favorites
+must stay the same however many users and favorites there are, and catalog reads served from
+the cache must run none.
+"""
+import pytest
+from sqlalchemy import event, insert, update
+from models import db, User, People, Planet, Starship, FavoritePeople, FavoriteStarships, FavoritePlanets, \
+    FavoritesDocument, GenderEnum
+
+CATALOG_SIZE = 12
+# GET /users: the page of users, then their favorites documents (one selectinload)
+USERS_PAGE_STATEMENTS = 2
+# Rebuilding cleared documents, however many: create the missing rows, read their generations,
+# one query per favorites kind, one executemany storing them
+REBUILD_STATEMENTS = 6
+# GET /users/<id>/favorites: the stored document
+FAVORITES_STATEMENTS = 1
+# GET /people/<id> and GET /people on a cold cache: the table version, then the entity or page
+CATALOG_MISS_STATEMENTS = 2
+# (users, favorites of each kind per user)
+SIZES = [(2, 1), (40, 10)]
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def statements(app):
+    """The SQL statements run since the list was last cleared."""
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def seed(app, users, favorites):
+    """`users` users with `favorites` favorites of each kind, and no favorites documents built yet."""
+    with app.app_context():
+        db.session.execute(insert(People), [
+            {'id': i, 'name': f'Person {i}', 'gender': GenderEnum.DROID, 'height': i} for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(Planet), [
+            {'id': i, 'name': f'Planet {i}', 'size': i, 'population': i, 'climate': 'arid'}
+            for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(Starship), [
+            {'id': i, 'name': f'Starship {i}', 'cost_in_credits': i, 'speed': i} for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(User), [
+            {'id': i, 'email': f'user{i}@example.com', 'password': 'secret', 'username': f'user{i}', 'name': f'User {i}'}
+            for i in range(1, users + 1)])
+        for model, column in ((FavoritePeople, 'people_id'), (FavoriteStarships, 'starship_id'),
+                              (FavoritePlanets, 'planet_id')):
+            db.session.execute(insert(model), [
+                {'user_id': user_id, column: entity_id}
+                for user_id in range(1, users + 1) for entity_id in range(1, favorites + 1)])
+        db.session.commit()
+
+
+def clear_documents(app):
+    with app.app_context():
+        db.session.execute(update(FavoritesDocument).values(document=None))
+        db.session.commit()
+
+
+def response_etag(client, url):
+    return client.get(url).headers['ETag']
+
+
+def count(client, statements, url):
+    statements.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('users, favorites', SIZES)
+def test_users_list(app, statements, users, favorites):
+    seed(app, users, favorites)
+    client = app.test_client()
+
+    # First read: every document is built, in one batch for the page
+    executed, body = count(client, statements, '/users')
+    assert executed == USERS_PAGE_STATEMENTS + REBUILD_STATEMENTS
+    assert len(body['data']) == users
+    assert [person['id'] for person in body['data'][-1]['favorite_people']] == list(range(1, favorites + 1))
+
+    executed, _ = count(client, statements, '/users')
+    assert executed == USERS_PAGE_STATEMENTS
+
+    clear_documents(app)
+    executed, _ = count(client, statements, '/users')
+    assert executed == USERS_PAGE_STATEMENTS + REBUILD_STATEMENTS
+
+
+@pytest.mark.parametrize('users, favorites', SIZES)
+def test_user_favorites(app, statements, users, favorites):
+    seed(app, users, favorites)
+    client = app.test_client()
+
+    executed, body = count(client, statements, f'/users/{users}/favorites')
+    assert executed == FAVORITES_STATEMENTS + REBUILD_STATEMENTS
+    assert [planet['id'] for planet in body['planets']] == list(range(1, favorites + 1))
+
+    executed, _ = count(client, statements, f'/users/{users}/favorites')
+    assert executed == FAVORITES_STATEMENTS
+
+
+@pytest.mark.parametrize('url', ['/people/3', '/planets/', '/starships?limit=5&after=2'])
+def test_catalog_reads(app, statements, url):
+    seed(app, 1, 1)
+    client = app.test_client()
+
+    executed, _ = count(client, statements, url)
+    assert executed == CATALOG_MISS_STATEMENTS
+    # Cache hits derive the ETag from the cached versions
+    executed, _ = count(client, statements, url)
+    assert executed == 0
+    statements.clear()
+    response = client.get(url, headers={'If-None-Match': response_etag(client, url)})
+    assert response.status_code == 304
+    assert statements == []
@@ -0,0 +1,83 @@
+"""
+GCRA rate limits on both backends, on a clock the tests move by hand.
+"""
+import pytest
+import ratelimit
+from ratelimit import Limit, MemoryBackend, SQLiteBackend, RateLimiter
+
+# 2 requests per second, bursts of 3: a request costs 0.5s of credit out of 1.5s
+LIMITS = {'default': Limit.parse('2/s:3'), 'list': Limit.parse('2/s:3')}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def limiter(request, tmp_path, clock):
+    backend = MemoryBackend() if request.param == 'memory' else SQLiteBackend(str(tmp_path / 'ratelimit.db'))
+    return RateLimiter(backend, LIMITS, clock)
+
+
+def hits(limiter, count, client='10.0.0.1'):
+    return [limiter.hit('default', client) for _ in range(count)]
+
+
+def test_burst(limiter):
+    decisions = hits(limiter, 4)
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert [decision.remaining for decision in decisions] == [2, 1, 0, 0]
+    assert decisions[-1].headers()['Retry-After'] == '1'
+    assert decisions[-1].retry_after == pytest.approx(0.5)
+    # Each client and each group has its own bucket
+    assert hits(limiter, 1, client='10.0.0.2')[0].allowed
+    assert limiter.hit('list', '10.0.0.1').allowed
+
+
+def test_refill(limiter, clock):
+    hits(limiter, 3)
+    clock.now += 0.25
+    assert not hits(limiter, 1)[0].allowed
+    # One interval later a single request fits again
+    clock.now += 0.25
+    assert [decision.allowed for decision in hits(limiter, 2)] == [True, False]
+    # An idle bucket refills up to the burst, no further
+    clock.now += 60
+    assert [decision.allowed for decision in hits(limiter, 4)] == [True, True, True, False]
+
+
+def test_refused_requests_cost_nothing(limiter, clock):
+    hits(limiter, 3)
+    hits(limiter, 10)
+    clock.now += 0.5
+    assert hits(limiter, 1)[0].allowed
+
+
+def test_responses(make_app, monkeypatch, limiter, clock):
+    monkeypatch.setenv('RATELIMIT_ENABLED', '1')
+    monkeypatch.setattr(ratelimit, '_limiter', limiter)
+    client = make_app().test_client()
+
+    for remaining in (2, 1, 0):
+        response = client.get('/people')
+        assert response.status_code == 200
+        assert response.headers['RateLimit-Limit'] == '3'
+        assert response.headers['RateLimit-Remaining'] == str(remaining)
+    response = client.get('/people')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert response.headers['RateLimit-Remaining'] == '0'
+
+    clock.now += 0.5
+    assert client.get('/people').status_code == 200
+    # Exempt endpoints are never limited
+    assert client.get('/healthz').status_code == 200
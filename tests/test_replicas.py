@@ -0,0 +1,54 @@
+"""
+Read-replica routing with two SQLite files standing in for the primary and its replica.
+"""
+import shutil
+import sqlite3
+import pytest
+import replicas
+from models import db, People, GenderEnum
+
+
+@pytest.fixture
+def app(make_app, tmp_path, monkeypatch):
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', f'sqlite:///{replica}')
+    monkeypatch.setattr(replicas.router, '_status', {})
+    monkeypatch.setattr(replicas, 'recent_writers', replicas.RecentWriters())
+    app = make_app('primary')
+    with app.app_context():
+        db.session.add(People(id=1, name='Luke Skywalker', gender=GenderEnum.MALE, height=172))
+        db.session.commit()
+        db.engines['replica_0'].dispose()
+    # The replica is a copy of the primary; renaming the row there tells which file answered
+    shutil.copy(primary, replica)
+    with sqlite3.connect(replica) as connection:
+        connection.execute("UPDATE people SET name = 'Luke (replica)' WHERE id = 1")
+    return app
+
+
+def create_person(client):
+    response = client.post('/people', json={'name': 'Leia Organa', 'gender': 'FEMALE', 'height': 150})
+    assert response.status_code == 201
+    return client.get('/people?limit=1&after=1').get_json()
+
+
+def test_reads_go_to_the_replica(app):
+    client = app.test_client()
+    assert client.get('/people/1').get_json()['name'] == 'Luke (replica)'
+    assert client.get('/people').get_json()[0]['name'] == 'Luke (replica)'
+
+
+def test_read_after_write_goes_to_the_primary(app):
+    client = app.test_client()
+    assert client.get('/people/1').get_json()['name'] == 'Luke (replica)'
+    # The new row exists only on the primary
+    assert [person['name'] for person in create_person(client)] == ['Leia Organa']
+    assert client.get('/people/1').get_json()['name'] == 'Luke Skywalker'
+
+
+def test_read_after_write_without_cookies(app):
+    writer = app.test_client(use_cookies=False)
+    assert [person['name'] for person in create_person(writer)] == ['Leia Organa']
+    # Another client keeps reading from the replica
+    other = app.test_client(use_cookies=False)
+    assert other.get('/people/1', environ_base={'REMOTE_ADDR': '10.0.0.2'}).get_json()['name'] == 'Luke (replica)'
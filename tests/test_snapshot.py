@@ -0,0 +1,81 @@
+"""
+Catalog snapshots are served only by a database holding the same content (table_version.snapshot_id).
+"""
+from models import db, User, People, GenderEnum, FavoritePeople
+from snapshot import Snapshot, export_snapshot, import_snapshot, served_table
+
+
+def seed(app, name, users=0):
+    """One person named `name`, and `users` users who all favorited them."""
+    with app.app_context():
+        db.session.add(People(id=1, name=name, gender=GenderEnum.MALE, height=172))
+        for user_id in range(1, users + 1):
+            db.session.add(User(id=user_id, email=f'user{user_id}@example.com', password='secret',
+                                username=f'user{user_id}', name=f'User {user_id}'))
+        db.session.flush()
+        for user_id in range(1, users + 1):
+            db.session.add(FavoritePeople(user_id=user_id, people_id=1))
+        db.session.commit()
+
+
+def add_users(app, users):
+    with app.app_context():
+        db.session.add_all(User(id=user_id, email=f'user{user_id}@example.com', password='secret',
+                                username=f'user{user_id}', name=f'User {user_id}') for user_id in range(1, users + 1))
+        db.session.commit()
+
+
+def is_served(app):
+    with app.test_request_context():
+        return served_table(People) is not None
+
+
+def test_snapshot_of_another_database_is_not_served(make_app, tmp_path, monkeypatch):
+    path = str(tmp_path / 'catalog.snap')
+    source = make_app('a')
+    seed(source, 'Luke Skywalker')
+    with source.app_context():
+        export_snapshot(path)
+
+    monkeypatch.setenv('CATALOG_SNAPSHOT', path)
+    other = make_app('b')
+    seed(other, 'Darth Vader')
+    # Both databases are at the same table version
+    assert Snapshot(path).tables['people'].version == 1
+    assert not is_served(other)
+    client = other.test_client()
+    assert client.get('/people/1').get_json()['name'] == 'Darth Vader'
+    assert [person['name'] for person in client.get('/people').get_json()] == ['Darth Vader']
+
+    exported_from = make_app('a')
+    assert is_served(exported_from)
+    assert exported_from.test_client().get('/people/1').get_json()['name'] == 'Luke Skywalker'
+
+
+def test_import_is_served_only_when_complete(make_app, tmp_path, monkeypatch):
+    path = str(tmp_path / 'catalog.snap')
+    source = make_app('a')
+    seed(source, 'Luke Skywalker', users=2)
+    with source.app_context():
+        export_snapshot(path)
+    monkeypatch.setenv('CATALOG_SNAPSHOT', path)
+
+    # The favorites of the missing users are skipped: favorite_count differs from the snapshot's
+    partial = make_app('partial')
+    add_users(partial, 1)
+    with partial.app_context():
+        _, skipped = import_snapshot(Snapshot(path))
+    assert skipped == 1
+    assert not is_served(partial)
+    assert partial.test_client().get('/people/1').get_json()['favorite_count'] == 1
+
+    complete = make_app('complete')
+    add_users(complete, 2)
+    with complete.app_context():
+        assert import_snapshot(Snapshot(path))[1] == 0
+    assert is_served(complete)
+
+    # The next write clears the content id
+    assert complete.test_client().delete('/favorite/people/1').status_code == 200
+    assert not is_served(complete)
+    assert complete.test_client().get('/people/1').get_json()['favorite_count'] == 1